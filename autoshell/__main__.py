@@ -0,0 +1,4 @@
+# 支持 python -m autoshell 启动
+from .cli import main
+
+main()
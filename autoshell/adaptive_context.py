@@ -129,6 +129,8 @@ class AdaptiveExecutionContext:
         self.total_steps = 0
         self.successful_steps = 0
         self.failed_steps = 0
+        # 阶段或步骤每发生一次变化加一，供调用方判断缓存的统计结果是否过期
+        self.version = 0
         
     def create_phase(
         self,
@@ -147,12 +149,14 @@ class AdaptiveExecutionContext:
             success_criteria=success_criteria
         )
         self.phases.append(phase)
+        self.version += 1
         return phase
     
     def set_current_phase(self, phase: TaskPhase):
         """设置当前阶段"""
         self.current_phase = phase
         phase.status = StepStatus.RUNNING
+        self.version += 1
     
     def add_step_to_current_phase(self, step: ExecutionStep):
         """添加步骤到当前阶段"""
@@ -161,6 +165,7 @@ class AdaptiveExecutionContext:
         
         self.current_phase.add_step(step)
         self.total_steps += 1
+        self.version += 1
         
         if step.success:
             self.successful_steps += 1
@@ -174,6 +179,7 @@ class AdaptiveExecutionContext:
         """完成当前阶段"""
         if self.current_phase:
             self.current_phase.status = StepStatus.SUCCESS if success else StepStatus.FAILED
+            self.version += 1
     
     def get_all_steps(self) -> List[ExecutionStep]:
         """获取所有步骤"""
@@ -303,6 +309,7 @@ class AdaptiveExecutionContext:
         self.total_steps = 0
         self.successful_steps = 0
         self.failed_steps = 0
+        self.version += 1
     
     def to_dict(self) -> Dict:
         """转换为字典（用于序列化）"""
@@ -1,7 +1,9 @@
 import os
 import shlex
+import threading
 import time
 from rich.console import Console
+from rich.markup import escape
 from rich.panel import Panel
 from rich.table import Table
 from rich.status import Status
@@ -16,22 +18,30 @@ from .interactive import InteractiveHandler, UserInputContext
 console = Console()
 
 class AutoShellAgent:
-    def __init__(self, ssh_config=None, context_files=None):
+    def __init__(self, ssh_config=None, context_files=None, refresh_context=False, batch=False):
         """
         初始化AutoShell Agent
         
         :param ssh_config: SSH配置字典，包含host, port, password, key_filename等
         :param context_files: 用户提供的上下文文件列表
+        :param refresh_context: 为 True 时忽略远程系统信息的磁盘缓存，重新收集
+        :param batch: SSH模式下，计划中的步骤全部为白名单命令时合并为一次远程执行
         """
         self.llm = LLMClient()
         self.max_retries = Config.MAX_RETRIES
         self.ssh_config = ssh_config
         self.context_files = context_files or []
+        self.batch = batch
+        # 取消标志：命令被 Ctrl+C 中断或外部调用 cancel() 后置位，执行循环在步骤之间检查
+        self._cancel_event = threading.Event()
+        # 上下文文件在会话内不变，格式化后的字符串只生成一次
+        self._user_context = None
         
         # 系统信息缓存
         self._system_info_cache = None
         self._cache_timestamp = None
         self._cache_ttl = Config.SYSTEM_INFO_CACHE_TTL
+        self._refresh_context = refresh_context
         
         # 用户输入上下文
         self.user_input_context = UserInputContext()
@@ -58,7 +68,11 @@ class AutoShellAgent:
                 
                 # 收集远程信息
                 with console.status("[bold green]Collecting remote system info...[/bold green]", spinner="dots"):
-                    self._system_info_cache = SSHContextManager.get_remote_system_info(self.ssh_config)
+                    self._system_info_cache = SSHContextManager.get_remote_system_info(
+                        self.ssh_config, refresh=self._refresh_context
+                    )
+                # 只在首次收集时强制刷新
+                self._refresh_context = False
             else:
                 # 本地模式：收集本地信息
                 self._system_info_cache = ContextManager.get_detailed_os_info()
@@ -93,6 +107,7 @@ class AutoShellAgent:
         Context -> LLM (Plan) -> Loop (Execute Steps) -> (Retry Step if fail) -> Output
         """
         error_history = []
+        self._cancel_event.clear()
         
         # 维护当前 Session 的 CWD
         # SSH模式下使用远程主机的家目录，本地模式使用当前目录
@@ -114,15 +129,16 @@ class AutoShellAgent:
         context_str += f"\n- Virtual Session CWD: {session_cwd}"
         
         # 添加用户上下文文件
-        user_context = ""
-        if self.context_files:
-            from .context_file import ContextFileManager
-            user_context = ContextFileManager.format_context_string(self.context_files)
+        user_context = self._get_user_context()
 
         # 尝试生成计划
         try:
-            with console.status("[bold green]Generating plan...[/bold green]", spinner="dots"):
-                plan_data = self.llm.generate_plan(user_query, context_str, user_context=user_context)
+            with console.status("[bold green]Generating plan...[/bold green]", spinner="dots") as status:
+                # 流式接收到 thought 后立即展示，不必等待完整计划
+                plan_data = self.llm.generate_plan(
+                    user_query, context_str, user_context=user_context,
+                    on_thought=lambda t: status.update(f"[bold green]Generating plan...[/bold green] [dim]{escape(t)}[/dim]")
+                )
         except Exception as e:
             console.print(f"[bold red]Planning Error:[/bold red] {str(e)}")
             return
@@ -142,7 +158,17 @@ class AutoShellAgent:
         self._print_plan_table(steps)
 
         # 2. Execute Steps
-        for i, step in enumerate(steps):
+        # 批量模式下先一次执行全部步骤，从第一个失败的步骤起转为逐步执行（含重试和自动修复）
+        # 批量执行中失败的那一步直接沿用其结果进入修复流程，不再原样重新执行
+        start, pending_result = 0, None
+        if self._can_batch(steps):
+            start, session_cwd, pending_result = self._run_steps_batched(steps, session_cwd)
+        
+        for i, step in enumerate(steps[start:], start):
+            if self._cancel_event.is_set():
+                console.print("[yellow]任务已取消[/yellow]")
+                return
+            
             description = step.get("description", "No description")
             command = step.get("command", "")
             
@@ -172,43 +198,23 @@ class AutoShellAgent:
             # 替换命令中的用户输入占位符
             command = self.user_input_context.replace_placeholders(command)
             
-            console.print(f"[dim]Command: {command}[/dim]")
-            console.print(f"[dim]CWD: {session_cwd}[/dim]")
+            console.print(f"[dim]Command: {command}[/dim]\n[dim]CWD: {session_cwd}[/dim]")
 
             # 检查是否是纯 CD 命令 (纯状态变更)
             # 只有不包含 &&、||、; 等操作符的纯 cd 命令才进行特殊处理
             # 包含这些操作符的组合命令应该交给 shell 执行
-            is_pure_cd = False
-            tokens = []
-            if not any(op in command for op in ["&&", "||", ";", "|"]):
-                # 解析 command，如果是 'cd path'
-                # Windows 下 shlex 默认 posix=True 会吃掉反斜杠，需根据 OS 调整
-                use_posix = os.name != 'nt'
-                try:
-                    tokens = shlex.split(command, posix=use_posix)
-                except ValueError:
-                    # 应对未闭合引号等情况，简单回退到 split
-                    tokens = command.split()
-                
-                if tokens and tokens[0] == "cd":
-                    is_pure_cd = True
+            target_dir = self._pure_cd_target(command)
+            is_pure_cd = target_dir is not None
             
             if is_pure_cd:
                 # SSH模式下，CD命令由远程shell处理，不在本地模拟
                 if self.ssh_config:
-                    # SSH模式：更新session_cwd用于显示，但实际由远程执行
-                    target_dir = tokens[1] if len(tokens) > 1 else "~"
-                    if session_cwd and target_dir.startswith('/'):
-                        session_cwd = target_dir
-                    elif session_cwd:
-                        session_cwd = f"{session_cwd}/{target_dir}" if session_cwd != "~" else target_dir
-                    else:
-                        session_cwd = target_dir
+                    # SSH模式：更新session_cwd，后续命令在远程执行时先 cd 到该目录
+                    session_cwd = self._join_remote_cwd(session_cwd, target_dir)
                     console.print(f"[green]✓ Changed directory to: {session_cwd}[/green]")
                     continue
                 else:
                     # 本地模式：实际改变工作目录
-                    target_dir = tokens[1] if len(tokens) > 1 else "~"
                     # 处理 ~
                     if target_dir == "~":
                         target_dir = os.path.expanduser("~")
@@ -233,7 +239,16 @@ class AutoShellAgent:
                 regenerate_count = 0
                 
                 for attempt in range(self.max_retries + 1):
-                    result = CommandExecutor.execute(command, cwd=session_cwd, description=description, ssh_config=self.ssh_config)
+                    if pending_result is not None:
+                        result, pending_result = pending_result, None
+                    else:
+                        result = CommandExecutor.execute(command, cwd=session_cwd, description=description, ssh_config=self.ssh_config)
+                    
+                    # 用户中断了命令：结束整个任务，不再请求 LLM 修复
+                    if result.get("interrupted"):
+                        self.cancel()
+                        console.print("[yellow]任务已取消[/yellow]")
+                        return
                     
                     # 检查是否需要重新生成命令
                     if result.get("regenerate") and regenerate_count < max_regenerate_attempts:
@@ -348,6 +363,138 @@ class AutoShellAgent:
 
         console.print("\n[bold green]All tasks completed successfully![/bold green]")
 
+    def cancel(self):
+        """
+        请求取消正在执行的任务
+        
+        当前命令结束后不再执行后续步骤，也不再重试或请求 LLM 修复；可从其他线程调用
+        """
+        self._cancel_event.set()
+    
+    def _get_user_context(self) -> str:
+        """返回格式化后的用户上下文文件内容（首次调用时生成并缓存）"""
+        if self._user_context is None:
+            self._user_context = ""
+            if self.context_files:
+                from .context_file import ContextFileManager
+                self._user_context = ContextFileManager.format_context_string(self.context_files)
+        return self._user_context
+    
+    @staticmethod
+    def _pure_cd_target(command: str):
+        """
+        解析纯 cd 命令（不含 &&、||、;、| 等操作符）
+        
+        :param command: 要检查的命令
+        :return: cd 的目标目录（无参数时为 ~），不是纯 cd 命令时返回 None
+        """
+        if any(op in command for op in ["&&", "||", ";", "|"]):
+            return None
+        # Windows 下 shlex 默认 posix=True 会吃掉反斜杠，需根据 OS 调整
+        use_posix = os.name != 'nt'
+        try:
+            tokens = shlex.split(command, posix=use_posix)
+        except ValueError:
+            # 应对未闭合引号等情况，简单回退到 split
+            tokens = command.split()
+        if not tokens or tokens[0] != "cd":
+            return None
+        return tokens[1] if len(tokens) > 1 else "~"
+    
+    @staticmethod
+    def _join_remote_cwd(session_cwd, target_dir: str) -> str:
+        """SSH模式下根据 cd 的目标目录计算新的 session_cwd（不访问远程主机）"""
+        if session_cwd and target_dir.startswith('/'):
+            return target_dir
+        if session_cwd:
+            return f"{session_cwd}/{target_dir}" if session_cwd != "~" else target_dir
+        return target_dir
+    
+    def _can_batch(self, steps) -> bool:
+        """
+        判断计划能否合并为一次远程执行：SSH批量模式、至少两步、且全部为无需确认的白名单命令
+        
+        需要PTY的命令（sudo 密码提示、top 等依赖终端的命令）不参与批量执行：批量通道不分配PTY
+        """
+        if not (self.batch and self.ssh_config) or len(steps) < 2:
+            return False
+        for step in steps:
+            command = step.get("command", "")
+            if InteractiveHandler.is_interactive_command(command):
+                return False
+            # 与逐步执行一致，按替换占位符后的实际命令检查
+            command = self.user_input_context.replace_placeholders(command)
+            if not CommandExecutor.is_safe(command):
+                return False
+            if CommandExecutor.needs_pty(command, is_safe_cmd=True):
+                return False
+        return True
+    
+    def _run_steps_batched(self, steps, session_cwd):
+        """
+        通过SSH批量执行步骤并逐步展示结果
+        
+        纯 cd 步骤不发送到远程，而是并入 session_cwd（与逐步执行时一致）；
+        相邻的其余步骤以 cd 后的 session_cwd 为工作目录合并为一次远程执行。
+        
+        :param steps: 计划中的步骤列表
+        :param session_cwd: 当前的远程工作目录
+        :return: (已完成的步骤数, 新的 session_cwd, 失败步骤的执行结果或 None)，
+                 调用方从该位置起逐步执行剩余步骤
+        """
+        # 与逐步执行一致，先替换命令中的用户输入占位符
+        commands = [self.user_input_context.replace_placeholders(step.get("command", "")) for step in steps]
+        
+        i = 0
+        while i < len(steps):
+            target_dir = self._pure_cd_target(commands[i])
+            if target_dir is not None:
+                session_cwd = self._join_remote_cwd(session_cwd, target_dir)
+                console.print(
+                    f"\n[bold cyan]Step {i+1}/{len(steps)}:[/bold cyan] {steps[i].get('description', 'No description')}\n"
+                    f"[green]✓ Changed directory to: {session_cwd}[/green]"
+                )
+                i += 1
+                continue
+            
+            end = i
+            while end < len(steps) and self._pure_cd_target(commands[end]) is None:
+                end += 1
+            
+            with console.status(f"[bold green]Executing {end - i} steps in one SSH session...[/bold green]", spinner="dots"):
+                results = CommandExecutor.execute_ssh_batch(
+                    commands[i:end],
+                    cwd=session_cwd,
+                    ssh_config=self.ssh_config
+                )
+            
+            # 各步骤的结果一次性展示，期间没有交互，先在内存中渲染完再整体写出
+            failed = None
+            with console.capture() as capture:
+                for result in results:
+                    if result["return_code"] != 0:
+                        console.print(f"\n[yellow]批量执行在第 {i+1} 步失败（返回码 {result['return_code']}），转为逐步执行[/yellow]")
+                        failed = result
+                        break
+                    
+                    console.print(
+                        f"\n[bold cyan]Step {i+1}/{len(steps)}:[/bold cyan] {steps[i].get('description', 'No description')}\n"
+                        f"[dim]Command: {commands[i]}[/dim]\n"
+                        f"[green]OK[/green]"
+                    )
+                    if result["stdout"].strip():
+                        console.print(Panel(result["stdout"], title="Output", border_style="green", expand=False))
+                    i += 1
+            
+            console.file.write(capture.get())
+            console.file.flush()
+            
+            # 某步失败，或批量执行未能跑完（如连接失败）：其余步骤交给逐步执行
+            if failed is not None or i < end:
+                return i, session_cwd, failed
+        
+        return i, session_cwd, None
+    
     def run_adaptive(self, user_query: str):
         """
         增强的自适应执行模式：
@@ -367,6 +514,7 @@ class AutoShellAgent:
             title="Enhanced Adaptive Mode",
             border_style="blue"
         ))
+        self._cancel_event.clear()
         
         # 获取系统上下文
         system_info = self._get_system_info()
@@ -379,10 +527,7 @@ class AutoShellAgent:
         context_str += f"\n- Virtual Session CWD: {session_cwd}"
         
         # 用户上下文
-        user_context = ""
-        if self.context_files:
-            from .context_file import ContextFileManager
-            user_context = ContextFileManager.format_context_string(self.context_files)
+        user_context = self._get_user_context()
         
         # 初始化组件
         planner = TaskPlanner(self.llm)
@@ -400,7 +545,7 @@ class AutoShellAgent:
         max_iterations = 50
         iteration = 0
         
-        while not planner.is_plan_complete() and iteration < max_iterations:
+        while not planner.is_plan_complete() and iteration < max_iterations and not self._cancel_event.is_set():
             iteration += 1
             
             # 获取下一个可执行的阶段
@@ -449,8 +594,7 @@ class AutoShellAgent:
                 description = step_data.get("description", "No description")
                 command = step_data.get("command", "")
                 
-                console.print(f"\n[bold cyan]步骤 {i+1}/{len(steps)}:[/bold cyan] {description}")
-                console.print(f"[dim]命令: {command}[/dim]")
+                console.print(f"\n[bold cyan]步骤 {i+1}/{len(steps)}:[/bold cyan] {description}\n[dim]命令: {command}[/dim]")
                 
                 # 执行命令（带重试和重新生成）
                 retry_count = 0
@@ -469,6 +613,11 @@ class AutoShellAgent:
                         ssh_config=self.ssh_config
                     )
                     
+                    # 用户中断了命令：不再重试，结束当前阶段和后续阶段
+                    if result.get("interrupted"):
+                        self.cancel()
+                        break
+                    
                     # 检查是否需要重新生成命令
                     if result.get("regenerate") and regenerate_count < max_regenerate_attempts:
                         feedback = result.get("feedback", "")
@@ -584,7 +733,10 @@ class AutoShellAgent:
                 
                 if not step_success:
                     phase_success = False
-                    console.print("[yellow]步骤失败，继续下一阶段[/yellow]")
+                    if self._cancel_event.is_set():
+                        console.print("[yellow]任务已取消[/yellow]")
+                    else:
+                        console.print("[yellow]步骤失败，继续下一阶段[/yellow]")
                     break
             
             # 完成当前阶段
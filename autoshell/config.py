@@ -1,14 +1,26 @@
 import os
 from dotenv import load_dotenv
-from rich.console import Console
 
-console = Console()
+_CONSOLE = None
+
+
+def get_console():
+    """
+    返回共享的 rich Console。
+    首次需要输出时才导入 rich，避免仅导入配置或 LLM 模块时就加载它。
+    """
+    global _CONSOLE
+    if _CONSOLE is None:
+        from rich.console import Console
+        _CONSOLE = Console()
+    return _CONSOLE
+
 
 # Load environment variables from .env file if it exists
 env_loaded = load_dotenv()
 
 class Config:
-    DEBUG = False  # 默认关闭debug输出，通过命令行参数--debug启用
+    DEBUG = os.getenv("AUTOSHELL_DEBUG", "false").lower() == "true"  # 默认关闭debug输出，通过命令行参数--debug或AUTOSHELL_DEBUG启用
     OPENAI_API_KEY = os.getenv("OPENAI_API_KEY", "not-needed")
     OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL", "https://api.openai.com/v1")
     LLM_MODEL = os.getenv("LLM_MODEL", "gpt-3.5-turbo")
@@ -42,18 +54,18 @@ class Config:
     @staticmethod
     def validate():
         if Config.DEBUG:
-            console.print(f"[dim][DEBUG] Validating configuration...[/dim]")
+            get_console().print(f"[dim][DEBUG] Validating configuration...[/dim]")
         
         # 检测提供商类型
         is_ollama = Config.is_ollama()
         provider_name = "Ollama (Local)" if is_ollama else "OpenAI Compatible"
         
         if Config.DEBUG:
-            console.print(f"[dim][DEBUG] LLM Provider: {provider_name}[/dim]")
-            console.print(f"[dim][DEBUG] OPENAI_API_KEY exists: {bool(Config.OPENAI_API_KEY)}[/dim]")
-            console.print(f"[dim][DEBUG] OPENAI_BASE_URL: {Config.OPENAI_BASE_URL}[/dim]")
-            console.print(f"[dim][DEBUG] LLM_MODEL: {Config.LLM_MODEL}[/dim]")
-            console.print(f"[dim][DEBUG] MAX_RETRIES: {Config.MAX_RETRIES}[/dim]")
+            get_console().print(f"[dim][DEBUG] LLM Provider: {provider_name}[/dim]")
+            get_console().print(f"[dim][DEBUG] OPENAI_API_KEY exists: {bool(Config.OPENAI_API_KEY)}[/dim]")
+            get_console().print(f"[dim][DEBUG] OPENAI_BASE_URL: {Config.OPENAI_BASE_URL}[/dim]")
+            get_console().print(f"[dim][DEBUG] LLM_MODEL: {Config.LLM_MODEL}[/dim]")
+            get_console().print(f"[dim][DEBUG] MAX_RETRIES: {Config.MAX_RETRIES}[/dim]")
         
         # 只对非 Ollama 提供商验证 API Key
         if not is_ollama and not Config.OPENAI_API_KEY:
@@ -64,4 +76,4 @@ class Config:
             )
         
         if Config.DEBUG:
-            console.print(f"[dim][DEBUG] Configuration validated successfully[/dim]")
+            get_console().print(f"[dim][DEBUG] Configuration validated successfully[/dim]")
@@ -1,3 +1,4 @@
+import functools
 import os
 import platform
 import getpass
@@ -10,12 +11,17 @@ class ContextManager:
     负责感知当前运行环境的上下文信息。
     """
     
+    # OS、Shell、用户名在进程生命周期内不变，首次获取后缓存；
+    # 工作目录会随 cd 变化，每次实时读取
+
     @staticmethod
+    @functools.lru_cache(maxsize=None)
     def get_os_info() -> str:
         """获取操作系统信息 (Windows/Linux/Darwin)"""
         return platform.system()
 
     @staticmethod
+    @functools.lru_cache(maxsize=None)
     def get_shell_type() -> str:
         """
         获取当前 Shell 类型。
@@ -42,6 +48,7 @@ class ContextManager:
         return os.getcwd()
 
     @staticmethod
+    @functools.lru_cache(maxsize=None)
     def get_user() -> str:
         """获取当前用户名"""
         return getpass.getuser()
@@ -65,6 +72,13 @@ class ContextManager:
             "user": cls.get_user()
         }
 
+    @classmethod
+    def invalidate(cls):
+        """清除缓存的上下文信息，下次获取时重新检测"""
+        cls.get_os_info.cache_clear()
+        cls.get_shell_type.cache_clear()
+        cls.get_user.cache_clear()
+
     @classmethod
     def get_context_string(cls) -> str:
         """获取格式化的上下文描述字符串，用于 Prompt"""
@@ -1,4 +1,5 @@
 import os
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from rich.console import Console
 
@@ -124,25 +125,56 @@ class ContextFileManager:
         :param max_size: 单个文件最大大小
         :return: 文件信息列表
         """
-        results = []
+        loaded = [ContextFileManager._load_file(filepath, max_size) for filepath in filepaths]
+        return ContextFileManager._collect_loaded(loaded)
+    
+    @staticmethod
+    def read_multiple_files_parallel(filepaths: list, max_size: int) -> list:
+        """
+        并行读取多个上下文文件，结果顺序与输入一致
         
-        for filepath in filepaths:
-            # 验证文件
-            is_valid, error_msg = ContextFileManager.validate_file(filepath, max_size)
-            
-            if not is_valid:
+        文件读取是 I/O 密集操作，多个文件（尤其位于网络存储上时）并行读取，
+        总耗时接近最慢的单个文件；只有一个文件时直接顺序读取
+        
+        :param filepaths: 文件路径列表
+        :param max_size: 单个文件最大大小
+        :return: 文件信息列表
+        """
+        if len(filepaths) < 2:
+            return ContextFileManager.read_multiple_files(filepaths, max_size)
+        
+        with ThreadPoolExecutor(max_workers=min(8, len(filepaths))) as executor:
+            loaded = list(executor.map(lambda p: ContextFileManager._load_file(p, max_size), filepaths))
+        return ContextFileManager._collect_loaded(loaded)
+    
+    @staticmethod
+    def _load_file(filepath: str, max_size: int) -> tuple:
+        """
+        验证并读取单个文件
+        
+        :return: (文件信息 or None, 错误信息 or None)
+        """
+        # 验证文件
+        is_valid, error_msg = ContextFileManager.validate_file(filepath, max_size)
+        if not is_valid:
+            return None, error_msg
+        
+        # 读取文件
+        file_info = ContextFileManager.read_context_file(filepath)
+        if file_info['error']:
+            return None, file_info['error']
+        
+        return file_info, None
+    
+    @staticmethod
+    def _collect_loaded(loaded: list) -> list:
+        """按输入顺序输出错误信息，返回读取成功的文件信息列表"""
+        results = []
+        for file_info, error_msg in loaded:
+            if error_msg:
                 console.print(f"[bold red]错误:[/bold red] {error_msg}")
                 continue
-            
-            # 读取文件
-            file_info = ContextFileManager.read_context_file(filepath)
-            
-            if file_info['error']:
-                console.print(f"[bold red]错误:[/bold red] {file_info['error']}")
-                continue
-            
             results.append(file_info)
-        
         return results
     
     @staticmethod
@@ -193,7 +225,8 @@ class ContextFileManager:
         if not context_files:
             return
         
-        console.print(f"\n[bold cyan]已加载 {len(context_files)} 个上下文文件:[/bold cyan]")
+        # 摘要拼成一段文本后一次输出
+        output = [f"\n[bold cyan]已加载 {len(context_files)} 个上下文文件:[/bold cyan]"]
         
         total_size = 0
         total_lines = 0
@@ -207,9 +240,9 @@ class ContextFileManager:
             total_lines += lines
             
             size_kb = size / 1024
-            console.print(f"  {i}. [green]{filename}[/green] - {size_kb:.2f}KB, {lines} 行")
+            output.append(f"  {i}. [green]{filename}[/green] - {size_kb:.2f}KB, {lines} 行")
         
         # 显示总计
         total_kb = total_size / 1024
-        console.print(f"\n[dim]总计: {total_kb:.2f}KB, {total_lines} 行[/dim]")
-        console.print()
+        output.append(f"\n[dim]总计: {total_kb:.2f}KB, {total_lines} 行[/dim]\n")
+        console.print("\n".join(output))
@@ -4,21 +4,82 @@ import os
 import time
 import sys
 import select
-from typing import Optional, Dict, Any
+import io
+import locale
+from typing import Optional, Dict, Any, List
 from rich.console import Console
 from rich.prompt import Confirm, Prompt
 from rich.panel import Panel
 from rich.syntax import Syntax
+from .config import Config
+# paramiko 在第一次执行远程命令时才导入，未安装时SSH功能不可用
+from .ssh_pool import SSH_AVAILABLE, connection_pool
+from .ssh_context import SSHContextManager
 
 console = Console()
 
-# 尝试导入paramiko，如果不存在则SSH功能不可用
-try:
-    import paramiko
-    SSH_AVAILABLE = True
-except ImportError:
-    SSH_AVAILABLE = False
-    paramiko = None  # type: ignore
+# 平台判断在模块加载时完成一次，避免输出循环中重复属性访问
+_IS_WIN = sys.platform == 'win32'
+
+# 本地命令输出每次读取的最大字节数
+_READ_CHUNK_SIZE = 65536
+
+# SSH输出轮询的休眠区间（秒）
+_SSH_POLL_MIN = 0.001
+_SSH_POLL_MAX = 0.05
+
+# 白名单内但依赖终端的命令（全屏界面等），SSH执行时仍需分配PTY
+_TTY_COMMANDS = frozenset({"top"})
+
+# 批量执行时每条命令输出前的分隔标记（NUL 不会出现在正常的文本输出中）
+_BATCH_MARK = b'\0STEP'
+
+# 本地命令输出的编码（与 text=True 时一致）
+_LOCAL_ENCODING = locale.getpreferredencoding(False)
+
+
+def _decode_local(buf: io.BytesIO) -> str:
+    """一次性解码本地命令输出"""
+    return buf.getvalue().decode(_LOCAL_ENCODING, errors='replace')
+
+
+def _write_stdout(data: bytes, encoding: str = 'utf-8'):
+    """将命令的标准输出原样写到控制台"""
+    stream = getattr(sys.stdout, 'buffer', None)
+    if _IS_WIN or stream is None:
+        print(data.decode(encoding, errors='replace'), end='', flush=True)
+        return
+    # 先刷新文本层，保证与 rich 已输出内容的先后顺序
+    sys.stdout.flush()
+    stream.write(data)
+    stream.flush()
+
+
+# 错误输出的红色 ANSI 序列，预先编码好直接写入
+_RED_ON = b'\x1b[31m'
+_RED_OFF = b'\x1b[0m'
+
+
+def _write_stderr(data: bytes, encoding: str = 'utf-8'):
+    """
+    以红色写出命令的错误输出。
+    
+    流式输出时每个数据块都走 console.print 会触发 rich 的标记解析和渲染，
+    错误输出较多时开销明显，因此直接向 stderr 写入原始字节。
+    """
+    if not data:
+        return
+    stream = getattr(sys.stderr, 'buffer', None)
+    if _IS_WIN or stream is None:
+        # Windows 控制台的颜色处理交给 rich
+        console.print(data.decode(encoding, errors='replace'), style="red", end='')
+        return
+    if sys.stderr.isatty():
+        stream.write(_RED_ON + data + _RED_OFF)
+    else:
+        stream.write(data)
+    stream.flush()
+
 
 class CommandExecutor:
     # 不可变白名单 (扩充)
@@ -79,9 +140,13 @@ class CommandExecutor:
         检查命令是否在白名单中。
         允许管道操作，但检查管道中的每个命令。
         """
+        command = command.strip()
+        if not command:
+            return False
+        
         try:
             # 允许管道，但不允许 && || ; 这些可能执行多个独立命令的操作符
-            if any(op in command for op in ["&&", "||", ";"]):
+            if '&&' in command or '||' in command or ';' in command:
                 return False
 
             # 如果包含管道，检查管道中的每个命令
@@ -108,6 +173,27 @@ class CommandExecutor:
         except Exception:
             return False
 
+    @classmethod
+    def needs_pty(cls, command: str, is_safe_cmd: Optional[bool] = None) -> bool:
+        """
+        SSH执行时是否需要分配PTY
+        
+        需要确认的命令、含 sudo 的命令（可能提示输入密码）以及依赖终端的命令（如 top）需要PTY；
+        其余白名单命令不分配PTY，省去远端终端处理，stdout/stderr 也能真正分开。
+        
+        :param command: 要执行的命令
+        :param is_safe_cmd: 已知的 is_safe 结果，未提供时重新检查
+        """
+        if is_safe_cmd is None:
+            is_safe_cmd = cls.is_safe(command)
+        if not is_safe_cmd or 'sudo' in command:
+            return True
+        for pipe_cmd in command.split("|"):
+            tokens = pipe_cmd.split()
+            if tokens and tokens[0].lower() in _TTY_COMMANDS:
+                return True
+        return False
+
     @classmethod
     def execute(cls, command: str, cwd: Optional[str] = None, description: Optional[str] = None, ssh_config: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
         """
@@ -158,81 +244,90 @@ class CommandExecutor:
                     "executed": True
                 }
 
-            # 使用Popen实现实时输出
+            # 使用Popen实现实时输出（字节模式，输出原样写入缓冲区，结束时统一解码）
             process = subprocess.Popen(
                 command,
                 shell=True,
                 cwd=cwd,
                 stdout=subprocess.PIPE,
                 stderr=subprocess.PIPE,
-                text=True,
-                bufsize=1  # 行缓冲
+                bufsize=0
             )
             
-            stdout_lines = []
-            stderr_lines = []
+            stdout_buf = io.BytesIO()
+            stderr_buf = io.BytesIO()
             
             # 实时读取输出
             try:
+                if not _IS_WIN:
+                    # Unix系统：管道fd设为非阻塞，select就绪后用os.read一次取走内核中已有的全部数据
+                    stdout_fd = process.stdout.fileno()  # type: ignore
+                    stderr_fd = process.stderr.fileno()  # type: ignore
+                    os.set_blocking(stdout_fd, False)
+                    os.set_blocking(stderr_fd, False)
+                    open_fds = [stdout_fd, stderr_fd]
+                
                 while True:
                     # 检查进程是否结束
                     if process.poll() is not None:
                         break
                     
-                    # 读取stdout（非阻塞）
-                    import select
-                    import sys
-                    
                     # Windows不支持select，使用简单的readline
-                    if sys.platform == 'win32':
+                    if _IS_WIN:
                         if process.stdout:
                             line = process.stdout.readline()
                             if line:
-                                stdout_lines.append(line)
-                                print(line, end='', flush=True)
+                                stdout_buf.write(line)
+                                _write_stdout(line, _LOCAL_ENCODING)
                     else:
-                        # Unix系统使用select
-                        streams = []
-                        if process.stdout:
-                            streams.append(process.stdout)
-                        if process.stderr:
-                            streams.append(process.stderr)
+                        if not open_fds:
+                            # 两个管道都已关闭，只需等待进程退出
+                            process.wait()
+                            break
                         
-                        if streams:
-                            readable, _, _ = select.select(streams, [], [], 0.1)
+                        readable, _, _ = select.select(open_fds, [], [], 0.1)
+                        
+                        for fd in readable:
+                            try:
+                                chunk = os.read(fd, _READ_CHUNK_SIZE)
+                            except BlockingIOError:
+                                continue
                             
-                            if process.stdout and process.stdout in readable:
-                                line = process.stdout.readline()
-                                if line:
-                                    stdout_lines.append(line)
-                                    print(line, end='', flush=True)
+                            if not chunk:
+                                open_fds.remove(fd)
+                                continue
                             
-                            if process.stderr and process.stderr in readable:
-                                line = process.stderr.readline()
-                                if line:
-                                    stderr_lines.append(line)
-                                    console.print(line, style="red", end='')
+                            if fd == stdout_fd:
+                                stdout_buf.write(chunk)
+                                _write_stdout(chunk, _LOCAL_ENCODING)
+                            else:
+                                stderr_buf.write(chunk)
+                                _write_stderr(chunk, _LOCAL_ENCODING)
                 
-                # 读取剩余输出
+                # 读取剩余输出（恢复阻塞模式，一直读到EOF）
                 if process.stdout:
+                    if not _IS_WIN:
+                        os.set_blocking(stdout_fd, True)
                     remaining_stdout = process.stdout.read()
                     if remaining_stdout:
-                        stdout_lines.append(remaining_stdout)
-                        print(remaining_stdout, end='', flush=True)
+                        stdout_buf.write(remaining_stdout)
+                        _write_stdout(remaining_stdout, _LOCAL_ENCODING)
                 
                 if process.stderr:
+                    if not _IS_WIN:
+                        os.set_blocking(stderr_fd, True)
                     remaining_stderr = process.stderr.read()
                     if remaining_stderr:
-                        stderr_lines.append(remaining_stderr)
-                        console.print(remaining_stderr, style="red", end='')
+                        stderr_buf.write(remaining_stderr)
+                        _write_stderr(remaining_stderr, _LOCAL_ENCODING)
                 
                 # 等待进程结束
                 process.wait()
                 
                 return {
                     "return_code": process.returncode,
-                    "stdout": ''.join(stdout_lines),
-                    "stderr": ''.join(stderr_lines),
+                    "stdout": _decode_local(stdout_buf),
+                    "stderr": _decode_local(stderr_buf),
                     "executed": True
                 }
                 
@@ -247,9 +342,10 @@ class CommandExecutor:
                 
                 return {
                     "return_code": -1,
-                    "stdout": ''.join(stdout_lines),
+                    "stdout": _decode_local(stdout_buf),
                     "stderr": "Process interrupted by user (Ctrl+C)",
-                    "executed": True
+                    "executed": True,
+                    "interrupted": True
                 }
                 
         except Exception as e:
@@ -287,17 +383,8 @@ class CommandExecutor:
                 "executed": False
             }
         
-        # 解析host（可能包含user@host格式）
-        host_str = ssh_config['host']
-        if '@' in host_str:
-            username, hostname = host_str.split('@', 1)
-        else:
-            username = None
-            hostname = host_str
-        
-        port = ssh_config.get('port', 22)
-        password = ssh_config.get('password')
-        key_filename = ssh_config.get('key_filename')
+        # 解析host（可能包含user@host格式），用于确认提示
+        hostname = ssh_config['host'].split('@', 1)[-1]
         
         # 安全检查（SSH模式下也需要确认危险命令）
         is_safe_cmd = cls.is_safe(command)
@@ -324,177 +411,147 @@ class CommandExecutor:
                 return {"return_code": -1, "stdout": "", "stderr": "User aborted execution.", "executed": False}
         
         try:
-            # 创建SSH客户端
-            client = paramiko.SSHClient()  # type: ignore
-            client.set_missing_host_key_policy(paramiko.AutoAddPolicy())  # type: ignore
-            
-            # 加载SSH配置文件
-            ssh_config_obj = paramiko.SSHConfig()  # type: ignore
-            ssh_config_path = os.path.expanduser('~/.ssh/config')
-            if os.path.exists(ssh_config_path):
-                with open(ssh_config_path) as f:
-                    ssh_config_obj.parse(f)
-                
-                # 查找主机配置
-                host_config = ssh_config_obj.lookup(hostname)
-                
-                # 从配置文件获取实际的主机名和其他参数
-                hostname = host_config.get('hostname', hostname)
-                if not username and 'user' in host_config:
-                    username = host_config['user']
-                if not key_filename and 'identityfile' in host_config:
-                    key_filename = host_config['identityfile'][0] if isinstance(host_config['identityfile'], list) else host_config['identityfile']
-                if 'port' in host_config:
-                    port = int(host_config['port'])
-            
-            # 连接参数
-            connect_kwargs = {
-                'hostname': hostname,
-                'port': port,
-            }
-            
-            if username:
-                connect_kwargs['username'] = username
-            
-            if key_filename:
-                # 展开路径中的 ~
-                key_filename = os.path.expanduser(key_filename)
-                connect_kwargs['key_filename'] = key_filename
-            elif password:
-                connect_kwargs['password'] = password
-            
-            # 连接到远程主机
-            client.connect(**connect_kwargs)
-            
-            # 如果指定了工作目录，需要在命令前加上cd
-            if cwd:
-                command = f"cd {cwd} && {command}"
-            
-            # 使用PTY执行命令，支持信号传递和中断
-            stdin, stdout, stderr = client.exec_command(
-                command,
-                get_pty=True  # 关键：分配伪终端，支持信号传递
-            )
-            
-            # 设置channel为非阻塞模式
-            stdout.channel.setblocking(0)
-            
-            stdout_data = []
-            stderr_data = []
-            
-            try:
-                # 非阻塞读取输出，实时显示并可响应KeyboardInterrupt
-                # 同时支持交互式输入（如sudo密码）
-                while not stdout.channel.exit_status_ready():
-                    # 检查是否有标准输出数据
-                    if stdout.channel.recv_ready():
-                        data = stdout.channel.recv(4096)
-                        decoded = data.decode('utf-8', errors='replace')
-                        stdout_data.append(decoded)
-                        # 实时输出到控制台
-                        print(decoded, end='', flush=True)
-                    
-                    # 检查是否有标准错误数据
-                    if stdout.channel.recv_stderr_ready():
-                        data = stdout.channel.recv_stderr(4096)
-                        decoded = data.decode('utf-8', errors='replace')
-                        stderr_data.append(decoded)
-                        # 实时输出错误到控制台（使用红色）
-                        console.print(decoded, style="red", end='')
-                    
-                    # 检查是否有用户输入（支持交互式命令如sudo）
-                    # Windows不支持select on stdin，使用msvcrt
-                    if sys.platform == 'win32':
-                        import msvcrt
-                        if msvcrt.kbhit():
-                            user_input = input()
-                            stdin.write(user_input + '\n')
-                            stdin.flush()
-                    else:
-                        # Unix系统使用select检查stdin
-                        readable, _, _ = select.select([sys.stdin], [], [], 0)
-                        if sys.stdin in readable:
-                            user_input = sys.stdin.readline()
-                            stdin.write(user_input)
-                            stdin.flush()
-                    
-                    # 短暂休眠，避免CPU占用过高
-                    time.sleep(0.05)  # 减少延迟以提高响应速度
-                
-                # 读取剩余数据
-                while stdout.channel.recv_ready():
-                    data = stdout.channel.recv(4096)
-                    decoded = data.decode('utf-8', errors='replace')
-                    stdout_data.append(decoded)
-                    print(decoded, end='', flush=True)
+            # 解析连接参数（与远程信息收集共用同一套 ~/.ssh/config 解析），
+            # 从进程级连接池借用连接：同一主机的后续命令复用已认证的会话，不再重复握手和认证
+            connect_kwargs = SSHContextManager._resolve_connect_kwargs(ssh_config, timeout=10)
+            with connection_pool.borrow(connect_kwargs) as client:
+                # 如果指定了工作目录，需要在命令前加上cd
+                if cwd:
+                    command = f"cd {cwd} && {command}"
                 
-                while stdout.channel.recv_stderr_ready():
-                    data = stdout.channel.recv_stderr(4096)
-                    decoded = data.decode('utf-8', errors='replace')
-                    stderr_data.append(decoded)
-                    console.print(decoded, style="red", end='')
+                # 只有需要交互（如sudo密码提示）或依赖终端的命令才分配PTY，支持信号传递和中断
+                interactive = cls.needs_pty(command, is_safe_cmd)
+                stdin, stdout, stderr = client.exec_command(
+                    command,
+                    get_pty=interactive
+                )
                 
-                # 获取退出状态
-                return_code = stdout.channel.recv_exit_status()
+                # 设置channel为非阻塞模式
+                stdout.channel.setblocking(0)
                 
-                # 关闭连接
-                client.close()
-                
-                return {
-                    "return_code": return_code,
-                    "stdout": ''.join(stdout_data),
-                    "stderr": ''.join(stderr_data),
-                    "executed": True
-                }
-                
-            except KeyboardInterrupt:
-                # 用户按下Ctrl+C，发送中断信号到远程进程
-                console.print("\n[yellow]Sending interrupt signal to remote process...[/yellow]")
+                stdout_buf = io.BytesIO()
+                stderr_buf = io.BytesIO()
                 
                 try:
-                    # 发送Ctrl+C (ASCII 3) 到远程进程
-                    stdout.channel.send(b'\x03')
-                    
-                    # 等待一小段时间让进程响应
-                    time.sleep(0.5)
-                    
-                    # 如果进程还在运行，再次发送中断信号
-                    if not stdout.channel.exit_status_ready():
-                        stdout.channel.send(b'\x03')
-                        time.sleep(0.5)
+                    # 非阻塞读取输出，实时显示并可响应KeyboardInterrupt
+                    # 同时支持交互式输入（如sudo密码）
+                    poll_interval = _SSH_POLL_MIN
+                    while not stdout.channel.exit_status_ready():
+                        has_activity = False
+                        
+                        # 检查是否有标准输出数据
+                        if stdout.channel.recv_ready():
+                            data = stdout.channel.recv(4096)
+                            stdout_buf.write(data)
+                            # 实时输出到控制台
+                            _write_stdout(data)
+                            has_activity = True
+                        
+                        # 检查是否有标准错误数据
+                        if stdout.channel.recv_stderr_ready():
+                            data = stdout.channel.recv_stderr(4096)
+                            stderr_buf.write(data)
+                            # 实时输出错误到控制台（使用红色）
+                            _write_stderr(data)
+                            has_activity = True
+                        
+                        # 检查是否有用户输入（支持交互式命令如sudo）
+                        # Windows不支持select on stdin，使用msvcrt
+                        if _IS_WIN:
+                            import msvcrt
+                            if msvcrt.kbhit():
+                                user_input = input()
+                                stdin.write(user_input + '\n')
+                                stdin.flush()
+                                has_activity = True
+                        else:
+                            # Unix系统使用select检查stdin
+                            readable, _, _ = select.select([sys.stdin], [], [], 0)
+                            if sys.stdin in readable:
+                                user_input = sys.stdin.readline()
+                                stdin.write(user_input)
+                                stdin.flush()
+                                has_activity = True
+                        
+                        # 自适应休眠：有数据时立即以最短间隔继续轮询，
+                        # 空闲时间隔逐次翻倍直到上限，避免CPU占用过高
+                        if has_activity:
+                            poll_interval = _SSH_POLL_MIN
+                        else:
+                            time.sleep(poll_interval)
+                            poll_interval = min(poll_interval * 2, _SSH_POLL_MAX)
                     
-                    # 读取剩余输出并实时显示
+                    # 读取剩余数据
                     while stdout.channel.recv_ready():
                         data = stdout.channel.recv(4096)
-                        decoded = data.decode('utf-8', errors='replace')
-                        stdout_data.append(decoded)
-                        print(decoded, end='', flush=True)
+                        stdout_buf.write(data)
+                        _write_stdout(data)
                     
                     while stdout.channel.recv_stderr_ready():
                         data = stdout.channel.recv_stderr(4096)
-                        decoded = data.decode('utf-8', errors='replace')
-                        stderr_data.append(decoded)
-                        console.print(decoded, style="red", end='')
+                        stderr_buf.write(data)
+                        _write_stderr(data)
                     
-                except Exception as e:
-                    # 忽略发送中断信号时的错误
-                    pass
-                
-                # 关闭连接
-                try:
+                    # 获取退出状态
+                    return_code = stdout.channel.recv_exit_status()
+                    
+                    # 只关闭本次命令的通道，连接留在池中供后续命令复用
                     stdout.channel.close()
-                except:
-                    pass
-                
-                client.close()
+                    
+                    return {
+                        "return_code": return_code,
+                        "stdout": stdout_buf.getvalue().decode('utf-8', errors='replace'),
+                        "stderr": stderr_buf.getvalue().decode('utf-8', errors='replace'),
+                        "executed": True
+                    }
+                    
+                except KeyboardInterrupt:
+                    # 用户按下Ctrl+C，发送中断信号到远程进程
+                    console.print("\n[yellow]Sending interrupt signal to remote process...[/yellow]")
+                    
+                    try:
+                        # 没有PTY时Ctrl+C不会被转换为信号，直接关闭channel即可
+                        if interactive:
+                            # 发送Ctrl+C (ASCII 3) 到远程进程
+                            stdout.channel.send(b'\x03')
+                            
+                            # 等待一小段时间让进程响应
+                            time.sleep(0.5)
+                            
+                            # 如果进程还在运行，再次发送中断信号
+                            if not stdout.channel.exit_status_ready():
+                                stdout.channel.send(b'\x03')
+                                time.sleep(0.5)
+                        
+                        # 读取剩余输出并实时显示
+                        while stdout.channel.recv_ready():
+                            data = stdout.channel.recv(4096)
+                            stdout_buf.write(data)
+                            _write_stdout(data)
+                        
+                        while stdout.channel.recv_stderr_ready():
+                            data = stdout.channel.recv_stderr(4096)
+                            stderr_buf.write(data)
+                            _write_stderr(data)
+                        
+                    except Exception as e:
+                        # 忽略发送中断信号时的错误
+                        pass
+                    
+                    # 关闭通道
+                    try:
+                        stdout.channel.close()
+                    except:
+                        pass
+                    
+                    return {
+                        "return_code": -1,
+                        "stdout": stdout_buf.getvalue().decode('utf-8', errors='replace'),
+                        "stderr": "Command interrupted by user (Ctrl+C)",
+                        "executed": True,
+                        "interrupted": True
+                    }
                 
-                return {
-                    "return_code": -1,
-                    "stdout": ''.join(stdout_data),
-                    "stderr": "Command interrupted by user (Ctrl+C)",
-                    "executed": True
-                }
-            
         except Exception as e:
             return {
                 "return_code": -1,
@@ -502,3 +559,73 @@ class CommandExecutor:
                 "stderr": f"SSH Error: {str(e)}",
                 "executed": True
             }
+    
+    @classmethod
+    def execute_ssh_batch(cls, commands: List[str], cwd: Optional[str] = None, ssh_config: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+        """
+        在一个SSH通道中依次执行多条白名单命令，遇到第一条失败的命令即停止
+        
+        每条命令前向 stdout 和 stderr 各写一个分隔标记，执行结束后按标记把输出拆回各条命令。
+        命令在同一个远程 shell 中依次执行，均以 cwd 为起始工作目录。
+        
+        :param commands: 要执行的命令列表（调用方需保证均已通过 is_safe 检查）
+        :param cwd: 远程工作目录
+        :param ssh_config: SSH配置
+        :return: 已执行命令的结果字典列表，与 commands 的前若干条一一对应；
+                 只有最后一条可能失败，未执行到的命令不在列表中
+        """
+        if not SSH_AVAILABLE or not ssh_config or 'host' not in ssh_config:
+            return []
+        
+        script = []
+        if cwd:
+            script.append(f"cd {cwd} || exit $?")
+        for i, command in enumerate(commands):
+            mark = f"\\0STEP{i}\\0"
+            script.append(f"printf '{mark}'; printf '{mark}' >&2")
+            # 用 { } 分组而不是子 shell；右花括号另起一行，命令以注释结尾时也不会把它吞掉
+            script.append(f"{{ {command}\n}} || exit $?")
+        
+        try:
+            connect_kwargs = SSHContextManager._resolve_connect_kwargs(ssh_config, timeout=10)
+            with connection_pool.borrow(connect_kwargs) as client:
+                stdin, stdout, stderr = client.exec_command("\n".join(script))
+                try:
+                    out = stdout.read()
+                    err = stderr.read()
+                    return_code = stdout.channel.recv_exit_status()
+                finally:
+                    stdout.channel.close()
+        except Exception as e:
+            if Config.DEBUG:
+                console.print(f"[dim][DEBUG] Batched SSH execution failed: {e}[/dim]")
+            return []
+        
+        outputs = cls._split_batch_output(out)
+        errors = cls._split_batch_output(err)
+        
+        results = []
+        for i in range(len(commands)):
+            if i not in outputs:
+                break
+            results.append({
+                "return_code": 0,
+                "stdout": outputs[i].decode('utf-8', errors='replace'),
+                "stderr": errors.get(i, b'').decode('utf-8', errors='replace'),
+                "executed": True
+            })
+        
+        # 脚本以非零状态退出时，失败的是最后一条输出了标记的命令
+        if results and return_code != 0:
+            results[-1]["return_code"] = return_code
+        return results
+    
+    @staticmethod
+    def _split_batch_output(data: bytes) -> Dict[int, bytes]:
+        """按分隔标记拆分批量执行的输出，返回 {命令序号: 输出}"""
+        parts = {}
+        for chunk in data.split(_BATCH_MARK)[1:]:
+            index, _, output = chunk.partition(b'\0')
+            if index.isdigit():
+                parts[int(index)] = output
+        return parts
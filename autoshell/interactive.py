@@ -270,13 +270,19 @@ class InteractiveHandler:
 class UserInputContext:
     """用户输入上下文管理器"""
     
+    # ${USER_INPUT_N} 占位符
+    _PH_INDEXED = re.compile(r'\$\{USER_INPUT_(\d+)\}')
+    
     def __init__(self):
         self.inputs: Dict[int, Any] = {}  # {step_index: value}
         self._password_steps: set = set()  # 记录哪些步骤是密码输入
+        self._last_key: Optional[int] = None  # 最大的步骤索引，供 ${USER_INPUT_LAST} 使用
     
     def store(self, step_index: int, value: Any, is_password: bool = False):
         """存储用户输入"""
         self.inputs[step_index] = value
+        if self._last_key is None or step_index > self._last_key:
+            self._last_key = step_index
         if is_password:
             self._password_steps.add(step_index)
     
@@ -295,7 +301,9 @@ class UserInputContext:
         :param command: 原始命令
         :return: 替换后的命令
         """
-        import re
+        # 绝大多数命令不含占位符，直接返回
+        if '${USER_INPUT' not in command:
+            return command
         
         # 替换 ${USER_INPUT_N}
         def replace_indexed(match):
@@ -303,11 +311,11 @@ class UserInputContext:
             value = self.get(index, "")
             return str(value)
         
-        command = re.sub(r'\$\{USER_INPUT_(\d+)\}', replace_indexed, command)
+        command = self._PH_INDEXED.sub(replace_indexed, command)
         
         # 替换 ${USER_INPUT_LAST}
-        if self.inputs:
-            last_value = self.inputs[max(self.inputs.keys())]
+        if self._last_key is not None and '${USER_INPUT_LAST}' in command:
+            last_value = self.inputs[self._last_key]
             command = command.replace('${USER_INPUT_LAST}', str(last_value))
         
         return command
@@ -315,6 +323,7 @@ class UserInputContext:
     def clear(self):
         """清空所有用户输入"""
         self.inputs.clear()
+        self._last_key = None
     
     def summary(self) -> str:
         """生成用户输入摘要"""
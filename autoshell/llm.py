@@ -1,126 +1,153 @@
+import asyncio
+import copy
+import functools
+import hashlib
 import json
+import random
 import re
 import time
-from openai import OpenAI
-from rich.console import Console
-from .config import Config
+import weakref
+from collections import OrderedDict
+from typing import Callable, NoReturn
+import httpx
+from openai import APIConnectionError, AsyncOpenAI, InternalServerError, OpenAI
+from .config import Config, get_console
 
-console = Console()
+# orjson 为可选依赖：已安装时用它解析 LLM 响应（C 实现，更快），否则使用标准库。
+# orjson.JSONDecodeError 是 json.JSONDecodeError 的子类，异常处理无需区分
+try:
+    import orjson
+    _loads = orjson.loads
+except ImportError:
+    _loads = json.loads
 
-class LLMClient:
-    def __init__(self):
-        Config.validate()
-        
-        # 检测提供商类型
-        self.is_ollama = Config.is_ollama()
-        provider_name = "Ollama (Local)" if self.is_ollama else "OpenAI Compatible"
-        
-        if Config.DEBUG:
-            console.print(f"[dim][DEBUG] Initializing LLM Client...[/dim]")
-            console.print(f"[dim][DEBUG] Provider: {provider_name}[/dim]")
-            console.print(f"[dim][DEBUG] API Base URL: {Config.OPENAI_BASE_URL}[/dim]")
-            console.print(f"[dim][DEBUG] Model: {Config.LLM_MODEL}[/dim]")
-        
-        # 安全显示API Key（如果存在且不是 Ollama）
-        if Config.DEBUG and not self.is_ollama and Config.OPENAI_API_KEY and Config.OPENAI_API_KEY != "not-needed":
-            masked_key = f"{Config.OPENAI_API_KEY[:10]}...{Config.OPENAI_API_KEY[-4:]}"
-            console.print(f"[dim][DEBUG] API Key: {masked_key}[/dim]")
-        
-        try:
-            self.client = OpenAI(
-                api_key=Config.OPENAI_API_KEY,
-                base_url=Config.OPENAI_BASE_URL,
-                timeout=30.0  # 添加30秒超时
-            )
-            if Config.DEBUG:
-                console.print(f"[dim][DEBUG] Client initialized successfully[/dim]")
-        except Exception as e:
-            console.print(f"[bold red][ERROR] Failed to initialize client: {str(e)}[/bold red]")
-            raise
-        
-        self.model = Config.LLM_MODEL
+# fastjsonschema 为可选依赖：已安装时用预编译的校验函数一次遍历检查 LLM 返回的
+# 结构，未安装时使用 LLMClient 中等价的逐项检查
+try:
+    import fastjsonschema
+except ImportError:
+    fastjsonschema = None
 
-    def _clean_json_response(self, content: str) -> str:
-        """
-        清理 LLM 可能返回的 Markdown 代码块标记，提取纯 JSON 字符串。
-        支持多种格式的响应。
-        """
-        content = content.strip()
-        
-        # 1. 移除 ```json ... ``` 或 ``` ... ``` 包裹
-        match = re.search(r"```(?:json)?\s*([\s\S]*?)\s*```", content)
-        if match:
-            content = match.group(1).strip()
-        
-        # 2. 提取第一个完整的JSON对象 {...}
-        # 使用更精确的方法：找到第一个{，然后匹配对应的}
-        first_brace = content.find('{')
-        if first_brace == -1:
-            return content
-        
-        # 从第一个{开始，计数括号来找到匹配的}
-        brace_count = 0
-        in_string = False
-        escape_next = False
-        
-        for i in range(first_brace, len(content)):
-            char = content[i]
-            
-            # 处理字符串中的引号
-            if escape_next:
-                escape_next = False
-                continue
-            
-            if char == '\\':
-                escape_next = True
-                continue
-            
-            if char == '"':
-                in_string = not in_string
-                continue
-            
-            # 只在非字符串中计数括号
-            if not in_string:
-                if char == '{':
-                    brace_count += 1
-                elif char == '}':
-                    brace_count -= 1
-                    if brace_count == 0:
-                        # 找到匹配的}，提取完整的JSON对象
-                        return content[first_brace:i+1]
-        
-        # 如果没有找到匹配的}，返回从第一个{到最后一个}
-        last_brace = content.rfind('}')
-        if last_brace > first_brace:
-            return content[first_brace:last_brace+1]
-        
-        return content.strip()
+# tiktoken 为可选依赖：用于按 token 预算截断执行历史，未安装时按字符数估算
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
 
-    def generate_plan(self, user_query: str, context_str: str, error_history: list | None = None, user_context: str = "") -> dict:
-        """
-        根据用户查询和环境上下文生成 Shell 命令计划。
-        
-        :param user_query: 用户的自然语言指令
-        :param context_str: 格式化后的系统环境信息
-        :param error_history: 之前的错误历史，用于重试/自愈逻辑
-        :param user_context: 用户提供的上下文文件内容
-        :return: 解析后的 JSON 字典 {"thought": ..., "steps": [{"description":..., "command":...}, ...]}
-        """
-        
-        if Config.DEBUG:
-            console.print(f"[dim][DEBUG] Starting plan generation for query: {user_query[:50]}...[/dim]")
-        start_time = time.time()
-        
-        system_prompt = f"""
-You are an expert system engineer and command-line wizard.
-Your goal is to translate natural language instructions into a SERIES of precise, efficient, and safe Shell commands.
+# LLM 响应中 ```json ... ``` 代码块的匹配模式
+_FENCE_RE = re.compile(r"```(?:json)?\s*([\s\S]*?)\s*```")
 
-Current Execution Environment:
-{context_str}
+_DECODER = json.JSONDecoder()
 
-{user_context}
+# 请求 JSON 模式时的 response_format 参数
+_JSON_MODE = {"type": "json_object"}
+
+# 流式响应中 "thought" 字段完整字符串值的匹配模式（含转义字符）
+_THOUGHT_RE = re.compile(r'"thought"\s*:\s*"((?:[^"\\]|\\.)*)"')
+
+# 流式扫描 JSON 结构时关心的字符：括号、引号和转义符
+_JSON_STRUCT_RE = re.compile(r'[{}"\\]')
+
+
+# 共享的 HTTP 连接池配置：保留足够的空闲长连接，避免每次请求都重新握手；
+# 不设置过小的连接上限，以免并发请求互相等待连接
+_HTTP_LIMITS = httpx.Limits(max_keepalive_connections=16, max_connections=32)
+_HTTP_TIMEOUT = httpx.Timeout(connect=10.0, read=60.0, write=10.0, pool=5.0)
 
-⚠️ IMPORTANT: Pay special attention to the system information above!
+_HTTP = httpx.Client(limits=_HTTP_LIMITS, timeout=_HTTP_TIMEOUT, follow_redirects=True)
+
+# 值得重试的错误：超时、连接失败和服务端 5xx（APITimeoutError 是 APIConnectionError
+# 的子类）。400 等请求错误重试也不会成功，不在此列
+_RETRYABLE_ERRORS = (APIConnectionError, InternalServerError, httpx.TimeoutException)
+
+
+@functools.lru_cache(maxsize=4)
+def _get_openai_client(api_key: str, base_url: str) -> OpenAI:
+    """
+    按 (api_key, base_url) 复用 OpenAI 客户端。
+    
+    Agent 在自愈、子任务等场景会多次创建 LLMClient，共享客户端和模块级
+    连接池可以复用已建立的 TCP + TLS 连接，避免每个实例都重新握手。
+    """
+    return OpenAI(
+        api_key=api_key,
+        base_url=base_url,
+        timeout=_HTTP_TIMEOUT,
+        http_client=_HTTP
+    )
+
+
+# 异步连接池会绑定到创建它的事件循环，因此按事件循环各保留一个共享连接池：
+# 事件循环 -> (httpx.AsyncClient, {(api_key, base_url): AsyncOpenAI})
+_ASYNC_CLIENTS: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, tuple]" = weakref.WeakKeyDictionary()
+
+
+def _get_async_openai_client(api_key: str, base_url: str) -> AsyncOpenAI:
+    """
+    按当前事件循环和 (api_key, base_url) 复用 AsyncOpenAI 客户端。
+    
+    只在第一次异步调用时创建，同步调用路径不会创建任何异步客户端；
+    同一事件循环中的所有 LLMClient 实例共用一个连接池。
+    """
+    loop = asyncio.get_running_loop()
+    entry = _ASYNC_CLIENTS.get(loop)
+    if entry is None:
+        http_client = httpx.AsyncClient(limits=_HTTP_LIMITS, timeout=_HTTP_TIMEOUT, follow_redirects=True)
+        entry = _ASYNC_CLIENTS[loop] = (http_client, {})
+    http_client, clients = entry
+    
+    client = clients.get((api_key, base_url))
+    if client is None:
+        client = clients[(api_key, base_url)] = AsyncOpenAI(
+            api_key=api_key,
+            base_url=base_url,
+            timeout=_HTTP_TIMEOUT,
+            http_client=http_client
+        )
+    return client
+
+
+# LLM 返回的步骤列表结构：每个步骤是对象，且必须有字符串类型的 command
+_STEPS_SCHEMA = {
+    "type": "array",
+    "items": {
+        "type": "object",
+        "required": ["command"],
+        "properties": {"command": {"type": "string"}}
+    }
+}
+_PLAN_SCHEMA = {
+    "type": "object",
+    "required": ["steps"],
+    "properties": {"steps": {**_STEPS_SCHEMA, "minItems": 1}}
+}
+_NEXT_STEPS_SCHEMA = {
+    "type": "object",
+    "required": ["steps"],
+    "properties": {"steps": _STEPS_SCHEMA}
+}
+
+if fastjsonschema is not None:
+    _VALIDATE_PLAN = fastjsonschema.compile(_PLAN_SCHEMA)
+    _VALIDATE_NEXT_STEPS = fastjsonschema.compile(_NEXT_STEPS_SCHEMA)
+else:
+    _VALIDATE_PLAN = _VALIDATE_NEXT_STEPS = None
+
+
+def _trunc(text: str, limit: int = 200) -> str:
+    """截断过长的文本并追加省略号"""
+    return text if len(text) <= limit else text[:limit] + "..."
+
+
+# 系统提示词的静态部分。不做任何插值，保证每次请求的前缀字节完全一致，
+# 以便服务端的前缀缓存（prompt caching）命中；执行环境等可变内容放在
+# 后续单独的 system 消息中。
+# *_OLLAMA 为完整版本，Ollama 没有 JSON 模式，需要靠大量示例约束输出格式
+_PLAN_SYSTEM_PROMPT_OLLAMA = """
+You are an expert system engineer and command-line wizard.
+Your goal is to translate natural language instructions into a SERIES of precise, efficient, and safe Shell commands.
+
+⚠️ IMPORTANT: Pay special attention to the system information in the execution environment message!
 - For Ubuntu/Debian systems (apt): use apt or apt-get commands
 - For CentOS/RHEL systems (yum/dnf): use yum (CentOS 7 and earlier) or dnf (CentOS 8+)
 - For Arch Linux (pacman): use pacman commands
@@ -137,37 +164,37 @@ Current Execution Environment:
 When you need user input or confirmation, you can use these special commands:
 
 1. User Confirmation (Yes/No):
-{{
+{
   "description": "Ask user for confirmation",
   "command": "__USER_CONFIRM__",
   "prompt": "Question to ask the user",
   "default": "yes"
-}}
+}
 
 2. User Text Input:
-{{
+{
   "description": "Get text input from user",
   "command": "__USER_INPUT__",
   "prompt": "What to ask the user",
   "default": "default value",
   "validation": "^[0-9]+$"
-}}
+}
 
 3. User Choice (Multiple Options):
-{{
+{
   "description": "Let user choose from options",
   "command": "__USER_CHOICE__",
   "prompt": "Question to ask",
   "options": ["option1", "option2", "option3"],
   "default": "option1"
-}}
+}
 
 4. User Password Input:
-{{
+{
   "description": "Get password from user",
   "command": "__USER_PASSWORD__",
   "prompt": "Password prompt"
-}}
+}
 
 WHEN TO USE INTERACTIVE COMMANDS:
 - When the user explicitly asks for input (e.g., "ask me", "let me choose", "I'll provide")
@@ -186,22 +213,22 @@ IMPORTANT:
 
 YOU MUST RESPOND WITH **ONLY** A VALID JSON OBJECT IN THIS **EXACT** FORMAT:
 
-{{
+{
    "thought": "Brief explanation of the plan",
    "steps": [
-      {{
+      {
          "description": "Step description",
          "command": "shell command"
-      }}
+      }
    ]
-}}
+}
 
 🚫 FORBIDDEN:
 - NO text before or after the JSON
 - NO markdown code blocks (no ```)
 - NO explanations outside the JSON
 - NO conversational text
-- NO other JSON structures (like {{"type":"shell"}} or {{"args":[]}})
+- NO other JSON structures (like {"type":"shell"} or {"args":[]})
 
 ✅ REQUIRED FIELDS:
 - "thought": string - Your reasoning (required)
@@ -213,97 +240,97 @@ YOU MUST RESPOND WITH **ONLY** A VALID JSON OBJECT IN THIS **EXACT** FORMAT:
 📋 EXAMPLES:
 
 Example 1 - Simple command "show current directory":
-{{
+{
    "thought": "Execute pwd command to show current working directory",
    "steps": [
-      {{
+      {
          "description": "Display current directory",
          "command": "pwd"
-      }}
+      }
    ]
-}}
+}
 
 Example 2 - Package installation on Ubuntu (non-root user):
-{{
+{
    "thought": "Install nginx using apt package manager on Ubuntu system",
    "steps": [
-      {{
+      {
          "description": "Update package lists",
          "command": "sudo apt update"
-      }},
-      {{
+      },
+      {
          "description": "Install nginx",
          "command": "sudo apt install -y nginx"
-      }}
+      }
    ]
-}}
+}
 
 Example 3 - Package installation on CentOS 8 (root user):
-{{
+{
    "thought": "Install nginx using dnf package manager on CentOS 8 system as root user (no sudo needed)",
    "steps": [
-      {{
+      {
          "description": "Install nginx",
          "command": "dnf install -y nginx"
-      }}
+      }
    ]
-}}
+}
 
 Example 4 - Interactive: User provides username:
-{{
+{
    "thought": "User wants to create a new user but will provide the username",
    "steps": [
-      {{
+      {
          "description": "Get username from user",
          "command": "__USER_INPUT__",
          "prompt": "请输入新用户的用户名",
          "validation": "^[a-z][a-z0-9_-]*$"
-      }},
-      {{
+      },
+      {
          "description": "Create user with provided username",
          "command": "sudo useradd ${USER_INPUT_1}"
-      }},
-      {{
+      },
+      {
          "description": "Set password for new user",
          "command": "sudo passwd ${USER_INPUT_1}"
-      }}
+      }
    ]
-}}
+}
 
 Example 5 - Interactive: Confirm destructive operation:
-{{
+{
    "thought": "Deleting files is destructive, need user confirmation",
    "steps": [
-      {{
+      {
          "description": "Confirm deletion of log files",
          "command": "__USER_CONFIRM__",
          "prompt": "即将删除 /var/log/*.log 文件，是否继续？",
          "default": "no"
-      }},
-      {{
+      },
+      {
          "description": "Delete log files",
          "command": "sudo rm -f /var/log/*.log"
-      }}
+      }
    ]
-}}
+}
 
 Example 6 - Interactive: Let user choose version:
-{{
+{
    "thought": "Multiple nginx versions available, let user choose",
    "steps": [
-      {{
+      {
          "description": "Let user select nginx version",
          "command": "__USER_CHOICE__",
          "prompt": "请选择要安装的 nginx 版本",
          "options": ["stable", "mainline", "legacy"],
          "default": "stable"
-      }},
-      {{
+      },
+      {
          "description": "Install selected nginx version",
          "command": "sudo apt install -y nginx-${USER_INPUT_1}"
-      }}
+      }
    ]
-}}
+}
 
 🔧 EXECUTION RULES:
 1. Analyze the user's request based on the current OS, distribution, and version
@@ -318,177 +345,10 @@ Example 6 - Interactive: Let user choose version:
 ⚠️ REMEMBER: Output ONLY the JSON object - absolutely nothing else!
 """
 
-        user_message = f"""User Request: {user_query}
-
-IMPORTANT: You MUST respond with ONLY a JSON object in this exact format:
-{{
-   "thought": "your reasoning here",
-   "steps": [
-      {{"description": "step description", "command": "shell command"}}
-   ]
-}}
-
-Do NOT include any other text, explanations, or markdown. ONLY the JSON object."""
-
-        if error_history:
-            # error_history 结构: [{"step_index": int, "command": str, "error": str}, ...]
-            error_context = "\n".join([f"Previous failure at step {e.get('step_index', '?')}:\nCommand: {e['command']}\nError: {e['error']}" for e in error_history])
-            user_message += f"\n\nPREVIOUS EXECUTION FAILED. Please analyze the errors and provide a FIXED plan (you can adjust the remaining steps):\n{error_context}"
-
-        raw_content = None  # 初始化变量以避免未绑定警告
-        
-        try:
-            if Config.DEBUG:
-                console.print(f"[dim][DEBUG] Calling LLM API with model: {self.model}[/dim]")
-            
-            # 构建API调用参数
-            api_params = {
-                "model": self.model,
-                "messages": [
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": user_message}
-                ],
-            }
-            
-            # 处理 JSON 模式
-            response = None
-            
-            if self.is_ollama:
-                # Ollama: 不使用 JSON 模式，依赖 prompt engineering
-                if Config.DEBUG:
-                    console.print(f"[dim][DEBUG] Using Ollama, relying on prompt for JSON output[/dim]")
-                response = self.client.chat.completions.create(**api_params)
-            else:
-                # 非 Ollama: 尝试使用 JSON 模式
-                json_mode_failed = False
-                
-                try:
-                    api_params["response_format"] = {"type": "json_object"}
-                    if Config.DEBUG:
-                        console.print(f"[dim][DEBUG] Attempting to enable JSON mode for model: {self.model}[/dim]")
-                    response = self.client.chat.completions.create(**api_params)
-                except Exception as e:
-                    error_msg = str(e)
-                    if "response_format" in error_msg or "400" in error_msg:
-                        if Config.DEBUG:
-                            console.print(f"[dim][DEBUG] JSON mode not supported by this API, retrying without it...[/dim]")
-                        json_mode_failed = True
-                    else:
-                        # 其他错误，直接抛出
-                        raise
-                
-                # 如果JSON模式失败，重试不带JSON模式
-                if json_mode_failed:
-                    api_params.pop("response_format", None)
-                    if Config.DEBUG:
-                        console.print(f"[dim][DEBUG] Calling API without JSON mode...[/dim]")
-                    response = self.client.chat.completions.create(**api_params)
-            
-            elapsed = time.time() - start_time
-            if Config.DEBUG:
-                console.print(f"[dim][DEBUG] LLM API responded in {elapsed:.2f}s[/dim]")
-            
-            # 确保response不为None
-            if response is None:
-                raise RuntimeError("API call succeeded but response is None")
-            
-            raw_content = response.choices[0].message.content
-            
-            if not raw_content:
-                if Config.DEBUG:
-                    console.print(f"[bold red][DEBUG] WARNING: LLM returned None or empty content![/bold red]")
-                raise ValueError("LLM returned empty response")
-            
-            # 只在出错时显示详细日志
-            # console.print(f"[dim][DEBUG] Raw response: {raw_content[:200]}...[/dim]")
-            
-            cleaned_content = self._clean_json_response(raw_content)
-            
-            result = json.loads(cleaned_content)
-            # console.print(f"[dim][DEBUG] Successfully parsed JSON with {len(result.get('steps', []))} steps[/dim]")
-            
-            # 验证JSON格式是否符合预期
-            if not isinstance(result, dict):
-                console.print(f"[bold red][ERROR] LLM returned invalid format: Expected dict, got {type(result)}[/bold red]")
-                console.print(f"[yellow]Raw response:[/yellow]\n{raw_content}")
-                raise ValueError(f"LLM returned invalid format: Expected dict, got {type(result)}")
-            
-            if "steps" not in result:
-                console.print(f"[bold red][ERROR] LLM returned JSON without 'steps' field![/bold red]")
-                console.print(f"[yellow]Received JSON structure:[/yellow] {list(result.keys())}")
-                console.print(f"[yellow]Full response:[/yellow]\n{raw_content}")
-                raise ValueError(f"LLM returned JSON without required 'steps' field. Got keys: {list(result.keys())}")
-            
-            if not isinstance(result.get("steps"), list):
-                console.print(f"[bold red][ERROR] 'steps' field is not a list![/bold red]")
-                console.print(f"[yellow]Full response:[/yellow]\n{raw_content}")
-                raise ValueError(f"'steps' field must be a list, got {type(result.get('steps'))}")
-            
-            if len(result.get("steps", [])) == 0:
-                console.print(f"[bold red][ERROR] LLM returned empty 'steps' list![/bold red]")
-                console.print(f"[yellow]Full response:[/yellow]\n{raw_content}")
-                raise ValueError("LLM returned empty 'steps' list")
-            
-            # 验证每个step的格式
-            for i, step in enumerate(result["steps"]):
-                if not isinstance(step, dict):
-                    console.print(f"[bold red][ERROR] Step {i+1} is not a dict![/bold red]")
-                    raise ValueError(f"Step {i+1} must be a dict, got {type(step)}")
-                if "command" not in step:
-                    console.print(f"[bold red][ERROR] Step {i+1} missing 'command' field![/bold red]")
-                    console.print(f"[yellow]Step content:[/yellow] {step}")
-                    raise ValueError(f"Step {i+1} missing required 'command' field")
-            
-            return result
-            
-        except json.JSONDecodeError as e:
-            if Config.DEBUG:
-                console.print(f"[bold red][DEBUG] JSON Parse Error: {str(e)}[/bold red]")
-                console.print(f"[dim][DEBUG] Raw content: {raw_content or 'N/A'}[/dim]")
-            raise ValueError(f"LLM returned invalid JSON: {str(e)}")
-        except Exception as e:
-            elapsed = time.time() - start_time
-            if Config.DEBUG:
-                console.print(f"[bold red][DEBUG] LLM API Error after {elapsed:.2f}s: {type(e).__name__}: {str(e)}[/bold red]")
-                import traceback
-                console.print(f"[dim][DEBUG] Traceback:\n{traceback.format_exc()}[/dim]")
-            raise RuntimeError(f"LLM API Error: {str(e)}")
-    
-    def generate_next_steps(
-        self,
-        user_goal: str,
-        context_str: str,
-        execution_history: list,
-        max_steps: int = 3,
-        user_context: str = ""
-    ) -> dict:
-        """
-        根据当前状态生成接下来的步骤（渐进式执行）
-        
-        :param user_goal: 用户的总体目标
-        :param context_str: 系统环境信息
-        :param execution_history: 已执行的步骤历史 [{"description": ..., "command": ..., "output": ..., "success": ...}, ...]
-        :param max_steps: 最多生成几个步骤
-        :param user_context: 用户提供的上下文文件内容
-        :return: {"thought": ..., "steps": [...], "is_complete": bool}
-        """
-        
-        if Config.DEBUG:
-            console.print(f"[dim][DEBUG] Generating next steps (max: {max_steps})...[/dim]")
-        start_time = time.time()
-        
-        # 构建执行历史摘要
-        history_summary = self._build_history_summary(execution_history)
-        
-        system_prompt = f"""
+_NEXT_SYSTEM_PROMPT_OLLAMA = """
 You are an expert system engineer with the ability to break down complex tasks into steps and adapt based on execution results.
 
-Current Execution Environment:
-{context_str}
-
-{user_context}
-
-⚠️ IMPORTANT: Pay special attention to the system information above!
+⚠️ IMPORTANT: Pay special attention to the system information in the execution environment message!
 - For Ubuntu/Debian systems (apt): use apt or apt-get commands
 - For CentOS/RHEL systems (yum/dnf): use yum (CentOS 7 and earlier) or dnf (CentOS 8+)
 - For Arch Linux (pacman): use pacman commands
@@ -503,19 +363,19 @@ Current Execution Environment:
 
 YOU MUST RESPOND WITH **ONLY** A VALID JSON OBJECT IN THIS **EXACT** FORMAT:
 
-{{
+{
    "thought": "Your reasoning about what to do next",
    "steps": [
-      {{
+      {
          "description": "Step description",
          "command": "shell command"
-      }}
+      }
    ],
    "is_complete": false
-}}
+}
 
 IMPORTANT RULES:
-1. Generate 1-{max_steps} steps based on the current situation
+1. Generate no more steps than the user message allows, based on the current situation
 2. Consider the execution history and previous outputs
 3. Use shell commands for ALL operations (cat, sed, grep, awk, etc.)
 4. Set "is_complete": true ONLY when the entire goal is achieved
@@ -534,83 +394,796 @@ EXAMPLES OF GOOD COMMANDS:
 Remember: Output ONLY the JSON object - absolutely nothing else!
 """
 
-        user_message = f"""User Goal: {user_goal}
+# 精简版本：response_format 已经保证输出 JSON，只需给出结构和一个示例
+_PLAN_SYSTEM_PROMPT_JSONMODE = """
+You are an expert system engineer. Translate the user's request into a series of precise, safe shell commands for the execution environment described in the next message.
 
-{history_summary}
+Rules:
+- Use the package manager, OS version and architecture from the environment info.
+- If "User Privilege: root", never use sudo; otherwise use sudo only when required.
+- Use Windows commands on Windows/PowerShell and Unix commands elsewhere; 'cd' is handled by the engine.
 
-Based on the execution history above, generate the next 1-{max_steps} steps to achieve the goal.
+Interactive steps (only when input is explicitly needed) use a special "command" instead of a shell command:
+- "__USER_CONFIRM__" with "prompt" and optional "default" ("yes"/"no")
+- "__USER_INPUT__" with "prompt", optional "default" and "validation" (regex)
+- "__USER_CHOICE__" with "prompt", "options" (list) and optional "default"
+- "__USER_PASSWORD__" with "prompt"
+Later steps can reference answers as ${USER_INPUT_N} (N = step number) or ${USER_INPUT_LAST}.
 
-IMPORTANT: You MUST respond with ONLY a JSON object in this exact format:
-{{
-   "thought": "your reasoning here",
-   "steps": [
-      {{"description": "step description", "command": "shell command"}}
-   ],
-   "is_complete": false
-}}
+Respond with a JSON object:
+{"thought": "brief reasoning", "steps": [{"description": "what the step does", "command": "shell command"}]}
 
-Do NOT include any other text, explanations, or markdown. ONLY the JSON object."""
+Example:
+{"thought": "Install nginx with apt as a non-root user", "steps": [{"description": "Update package lists", "command": "sudo apt update"}, {"description": "Install nginx", "command": "sudo apt install -y nginx"}]}
+"""
 
-        raw_content = None
+_NEXT_SYSTEM_PROMPT_JSONMODE = """
+You are an expert system engineer executing a task step by step and adapting to the results so far. The execution environment is described in the next message.
+
+Rules:
+- Use the package manager, OS version and architecture from the environment info.
+- If "User Privilege: root", never use sudo; otherwise use sudo only when required.
+- Use shell commands for all operations (cat, sed, grep, awk, ...); keep each step atomic.
+- Never return more steps than the user message allows.
+- Set "is_complete" to true only when the whole goal is achieved.
+
+Respond with a JSON object:
+{"thought": "reasoning about what to do next", "steps": [{"description": "what the step does", "command": "shell command"}], "is_complete": false}
+"""
+
+
+class LLMClient:
+    # 计划缓存的最大条目数
+    PLAN_CACHE_SIZE = 128
+    
+    # 发送给 LLM 的执行历史摘要的 token 预算
+    HISTORY_TOKEN_BUDGET = 2000
+    
+    # 单次请求的超时时间（秒）与超时/服务端错误时的最大重试次数。
+    # 超时设在正常响应时间附近：偶发的慢请求尽早放弃并重试，而不是等满整个超时
+    retry_request_timeout: float = 15.0
+    max_retries: int = 2
+    
+    # 各 (base_url, model) 是否支持 JSON 模式；未记录时先尝试 JSON 模式，
+    # 确认不支持后不再为它浪费一次失败的请求
+    _JSON_MODE_SUPPORT: dict[tuple[str, str], bool] = {}
+    
+    def __init__(self):
+        Config.validate()
+        
+        # 检测提供商类型
+        self.is_ollama = Config.is_ollama()
+        provider_name = "Ollama (Local)" if self.is_ollama else "OpenAI Compatible"
+        
+        if Config.DEBUG:
+            get_console().print(f"[dim][DEBUG] Initializing LLM Client...[/dim]")
+            get_console().print(f"[dim][DEBUG] Provider: {provider_name}[/dim]")
+            get_console().print(f"[dim][DEBUG] API Base URL: {Config.OPENAI_BASE_URL}[/dim]")
+            get_console().print(f"[dim][DEBUG] Model: {Config.LLM_MODEL}[/dim]")
+        
+        # 安全显示API Key（如果存在且不是 Ollama）
+        if Config.DEBUG and not self.is_ollama and Config.OPENAI_API_KEY and Config.OPENAI_API_KEY != "not-needed":
+            masked_key = f"{Config.OPENAI_API_KEY[:10]}...{Config.OPENAI_API_KEY[-4:]}"
+            get_console().print(f"[dim][DEBUG] API Key: {masked_key}[/dim]")
         
         try:
+            self.client = _get_openai_client(Config.OPENAI_API_KEY, Config.OPENAI_BASE_URL)
             if Config.DEBUG:
-                console.print(f"[dim][DEBUG] Calling LLM API for next steps...[/dim]")
-            
-            api_params = {
-                "model": self.model,
-                "messages": [
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": user_message}
-                ],
-                "temperature": 0.5  # 稍低的温度以获得更确定的输出
-            }
-            
-            # 处理 JSON 模式
-            response = None
-            
-            if self.is_ollama:
-                # Ollama: 直接调用
-                if Config.DEBUG:
-                    console.print(f"[dim][DEBUG] Using Ollama for adaptive execution[/dim]")
-                response = self.client.chat.completions.create(**api_params)
-            else:
-                # 非 Ollama: 尝试 JSON 模式
-                json_mode_failed = False
-                
-                try:
-                    api_params["response_format"] = {"type": "json_object"}
-                    response = self.client.chat.completions.create(**api_params)
-                except Exception as e:
-                    error_msg = str(e)
-                    if "response_format" in error_msg or "400" in error_msg:
-                        if Config.DEBUG:
-                            console.print(f"[dim][DEBUG] JSON mode not supported, retrying without it...[/dim]")
-                        json_mode_failed = True
-                    else:
-                        raise
-                
-                if json_mode_failed:
-                    api_params.pop("response_format", None)
-                    response = self.client.chat.completions.create(**api_params)
-            
-            elapsed = time.time() - start_time
-            if Config.DEBUG:
-                console.print(f"[dim][DEBUG] LLM API responded in {elapsed:.2f}s[/dim]")
-            
-            if response is None:
-                raise RuntimeError("API call succeeded but response is None")
-            
-            raw_content = response.choices[0].message.content
-            
-            if not raw_content:
-                raise ValueError("LLM returned empty response")
-            
-            cleaned_content = self._clean_json_response(raw_content)
-            result = json.loads(cleaned_content)
-            
-            # 验证格式
-            if not isinstance(result, dict):
+                get_console().print(f"[dim][DEBUG] Client initialized successfully[/dim]")
+        except Exception as e:
+            get_console().print(f"[bold red][ERROR] Failed to initialize client: {str(e)}[/bold red]")
+            raise
+        
+        self.model = Config.LLM_MODEL
+        
+        # 计划缓存：相同的请求直接复用已解析的结果，省去一次 LLM 往返
+        self._plan_cache: OrderedDict[bytes, dict] = OrderedDict()
+        
+        # tiktoken 编码器，首次计算 token 数时加载；加载失败时为 False
+        self._token_encoder = None
+
+    def _extract_json_object(self, content: str, json_mode: bool = False) -> dict:
+        """
+        从 LLM 响应中提取并解析第一个 JSON 对象。
+        
+        先移除可能存在的 Markdown 代码块标记，再用 raw_decode 从第一个{开始
+        一次完成定位和解析，避免先截取字符串再重复 json.loads。
+        
+        :param content: LLM 返回的原始文本
+        :param json_mode: 响应是否在 JSON 模式下生成；是则直接解析，失败时才走完整提取
+        :return: 解析后的 JSON 对象
+        :raises json.JSONDecodeError: 无法解析出合法 JSON 时
+        """
+        if json_mode:
+            # JSON 模式下服务端保证输出就是一个 JSON 对象，跳过正则和括号定位
+            try:
+                return _loads(content)
+            except json.JSONDecodeError:
+                pass
+        
+        content = content.strip()
+        
+        # 1. 移除 ```json ... ``` 或 ``` ... ``` 包裹
+        match = _FENCE_RE.search(content)
+        if match:
+            content = match.group(1).strip()
+        
+        # 2. 解析第一个完整的JSON对象 {...}
+        first_brace = content.find('{')
+        if first_brace == -1:
+            return _loads(content)
+        
+        # 常见情况下整段内容就是一个 JSON 对象，直接整体解析
+        if first_brace == 0 and content.endswith('}'):
+            try:
+                return _loads(content)
+            except json.JSONDecodeError:
+                pass
+        
+        try:
+            return _DECODER.raw_decode(content, first_brace)[0]
+        except json.JSONDecodeError:
+            pass
+        
+        # 无法完整解析时，尝试从第一个{到最后一个}
+        last_brace = content.rfind('}')
+        if last_brace > first_brace:
+            return _loads(content[first_brace:last_brace+1])
+        
+        return _loads(content)
+    
+    def _clean_json_response(self, content: str) -> str:
+        """
+        提取 LLM 响应中的 JSON 字符串（兼容旧调用方式）。
+        新代码请直接使用 _extract_json_object 获取解析结果。
+        """
+        return json.dumps(self._extract_json_object(content), ensure_ascii=False)
+    
+    def _raise_llm_error(self, e: Exception, raw_content: str | None, start_time: float) -> NoReturn:
+        """将调用或解析过程中的异常转换为统一的错误类型（需在 except 块中调用）"""
+        if isinstance(e, json.JSONDecodeError):
+            if Config.DEBUG:
+                get_console().print(f"[bold red][DEBUG] JSON Parse Error: {str(e)}[/bold red]")
+                get_console().print(f"[dim][DEBUG] Raw content: {raw_content or 'N/A'}[/dim]")
+            raise ValueError(f"LLM returned invalid JSON: {str(e)}")
+        
+        elapsed = time.time() - start_time
+        if Config.DEBUG:
+            get_console().print(f"[bold red][DEBUG] LLM API Error after {elapsed:.2f}s: {type(e).__name__}: {str(e)}[/bold red]")
+            import traceback
+            get_console().print(f"[dim][DEBUG] Traceback:\n{traceback.format_exc()}[/dim]")
+        raise RuntimeError(f"LLM API Error: {str(e)}")
+    
+    def _json_mode_supported(self) -> bool:
+        """当前服务/模型是否可能支持 JSON 模式（未知时视为支持）"""
+        return self._JSON_MODE_SUPPORT.get((Config.OPENAI_BASE_URL, self.model), True)
+    
+    def _mark_json_mode_supported(self, supported: bool):
+        """记录当前服务/模型对 JSON 模式的支持情况"""
+        self._JSON_MODE_SUPPORT[(Config.OPENAI_BASE_URL, self.model)] = supported
+    
+    def _attempt_timeout(self, attempt: int):
+        """第 attempt 次尝试（从 0 开始）使用的超时设置"""
+        # Ollama 本地推理本身较慢；最后一次尝试也不再截断，二者都使用完整超时
+        if self.is_ollama or attempt >= self.max_retries:
+            return _HTTP_TIMEOUT
+        return self.retry_request_timeout
+    
+    def _retry_delay(self, attempt: int, e: Exception) -> float:
+        """计算第 attempt 次失败后的退避时间（指数退避加随机抖动）"""
+        delay = random.uniform(0.2, 0.5) * 2 ** attempt
+        if Config.DEBUG:
+            get_console().print(f"[dim][DEBUG] LLM request failed ({type(e).__name__}), retrying in {delay:.2f}s...[/dim]")
+        return delay
+    
+    def _cache_key(self, kind: str, user_query: str, context_str: str, extra, user_context: str) -> bytes:
+        """对请求参数做规范化哈希，作为计划缓存的键"""
+        normalized_query = " ".join(user_query.split())
+        payload = "\x00".join([
+            kind,
+            self.model,
+            normalized_query,
+            context_str,
+            json.dumps(extra or [], ensure_ascii=False, sort_keys=True),
+            user_context
+        ])
+        return hashlib.blake2b(payload.encode(), digest_size=16).digest()
+    
+    def _cache_get(self, key: bytes) -> dict | None:
+        """读取缓存，返回副本以免调用方修改缓存内容"""
+        cached = self._plan_cache.get(key)
+        if cached is None:
+            return None
+        self._plan_cache.move_to_end(key)
+        if Config.DEBUG:
+            get_console().print(f"[dim][DEBUG] Plan cache hit[/dim]")
+        return copy.deepcopy(cached)
+    
+    def _cache_put(self, key: bytes, result: dict):
+        """写入缓存，超出容量时淘汰最久未使用的条目"""
+        self._plan_cache[key] = copy.deepcopy(result)
+        self._plan_cache.move_to_end(key)
+        if len(self._plan_cache) > self.PLAN_CACHE_SIZE:
+            self._plan_cache.popitem(last=False)
+    
+    def _environment_message(self, context_str: str, user_context: str = "") -> dict:
+        """构建携带执行环境信息的 system 消息，放在静态提示词之后"""
+        content = f"Current Execution Environment:\n{context_str}"
+        if user_context:
+            content += f"\n\n{user_context}"
+        return {"role": "system", "content": content}
+    
+    def _build_plan_messages(self, user_query: str, context_str: str, error_history: list | None = None, user_context: str = "") -> list:
+        """构建 generate_plan 的对话消息"""
+        user_message = f"User Request: {user_query}"
+        if self.is_ollama:
+            user_message += """
+
+IMPORTANT: You MUST respond with ONLY a JSON object in this exact format:
+{
+   "thought": "your reasoning here",
+   "steps": [
+      {"description": "step description", "command": "shell command"}
+   ]
+}
+
+Do NOT include any other text, explanations, or markdown. ONLY the JSON object."""
+
+        if error_history:
+            # error_history 结构: [{"step_index": int, "command": str, "error": str}, ...]
+            error_context = "\n".join([f"Previous failure at step {e.get('step_index', '?')}:\nCommand: {e['command']}\nError: {e['error']}" for e in error_history])
+            user_message += f"\n\nPREVIOUS EXECUTION FAILED. Please analyze the errors and provide a FIXED plan (you can adjust the remaining steps):\n{error_context}"
+        
+        return [
+            {"role": "system", "content": _PLAN_SYSTEM_PROMPT_OLLAMA if self.is_ollama else _PLAN_SYSTEM_PROMPT_JSONMODE},
+            self._environment_message(context_str, user_context),
+            {"role": "user", "content": user_message}
+        ]
+    
+    def _parse_plan(self, raw_content: str | None, json_mode: bool = False) -> dict:
+        """解析并验证 generate_plan 的 LLM 响应"""
+        if not raw_content:
+            if Config.DEBUG:
+                get_console().print(f"[bold red][DEBUG] WARNING: LLM returned None or empty content![/bold red]")
+            raise ValueError("LLM returned empty response")
+        
+        # 只在出错时显示详细日志
+        # get_console().print(f"[dim][DEBUG] Raw response: {raw_content[:200]}...[/dim]")
+        
+        result = self._extract_json_object(raw_content, json_mode)
+        # get_console().print(f"[dim][DEBUG] Successfully parsed JSON with {len(result.get('steps', []))} steps[/dim]")
+        
+        return self._validate_plan(result, raw_content)
+    
+    def _validate_plan(self, result, raw_content: str) -> dict:
+        """验证单个计划对象的结构，raw_content 仅用于输出错误信息"""
+        if _VALIDATE_PLAN is not None:
+            try:
+                return _VALIDATE_PLAN(result)
+            except fastjsonschema.JsonSchemaValueException as e:
+                get_console().print(f"[bold red][ERROR] LLM returned an invalid plan: {e.message}[/bold red]")
+                get_console().print(f"[yellow]Full response:[/yellow]\n{raw_content}")
+                raise ValueError(f"LLM returned an invalid plan: {e.message}")
+        
+        # 验证JSON格式是否符合预期
+        if not isinstance(result, dict):
+            get_console().print(f"[bold red][ERROR] LLM returned invalid format: Expected dict, got {type(result)}[/bold red]")
+            get_console().print(f"[yellow]Raw response:[/yellow]\n{raw_content}")
+            raise ValueError(f"LLM returned invalid format: Expected dict, got {type(result)}")
+        
+        if "steps" not in result:
+            get_console().print(f"[bold red][ERROR] LLM returned JSON without 'steps' field![/bold red]")
+            get_console().print(f"[yellow]Received JSON structure:[/yellow] {list(result.keys())}")
+            get_console().print(f"[yellow]Full response:[/yellow]\n{raw_content}")
+            raise ValueError(f"LLM returned JSON without required 'steps' field. Got keys: {list(result.keys())}")
+        
+        if not isinstance(result.get("steps"), list):
+            get_console().print(f"[bold red][ERROR] 'steps' field is not a list![/bold red]")
+            get_console().print(f"[yellow]Full response:[/yellow]\n{raw_content}")
+            raise ValueError(f"'steps' field must be a list, got {type(result.get('steps'))}")
+        
+        if len(result.get("steps", [])) == 0:
+            get_console().print(f"[bold red][ERROR] LLM returned empty 'steps' list![/bold red]")
+            get_console().print(f"[yellow]Full response:[/yellow]\n{raw_content}")
+            raise ValueError("LLM returned empty 'steps' list")
+        
+        # 验证每个step的格式
+        for i, step in enumerate(result["steps"]):
+            if not isinstance(step, dict):
+                get_console().print(f"[bold red][ERROR] Step {i+1} is not a dict![/bold red]")
+                raise ValueError(f"Step {i+1} must be a dict, got {type(step)}")
+            if "command" not in step:
+                get_console().print(f"[bold red][ERROR] Step {i+1} missing 'command' field![/bold red]")
+                get_console().print(f"[yellow]Step content:[/yellow] {step}")
+                raise ValueError(f"Step {i+1} missing required 'command' field")
+            if not isinstance(step["command"], str):
+                get_console().print(f"[bold red][ERROR] Step {i+1} 'command' is not a string![/bold red]")
+                raise ValueError(f"Step {i+1} 'command' must be a string, got {type(step['command'])}")
+        
+        return result
+    
+    def _stream_completion(
+        self,
+        client: OpenAI,
+        api_params: dict,
+        on_thought: Callable[[str], None] | None = None,
+        on_progress: Callable[[str], None] | None = None
+    ) -> str:
+        """
+        以流式方式调用 chat.completions，边接收边解析。
+        
+        thought 字段的值一旦完整就通过回调交给调用方展示；顶层 JSON 对象
+        闭合后即停止读取，不再等待流结束。
+        
+        :param client: 本次请求使用的客户端
+        :param api_params: chat.completions.create 的参数
+        :param on_thought: 接收 thought 文本的回调
+        :param on_progress: 收到含右括号的增量（可能有对象闭合）时，以累积文本调用；
+                            每个流开始时先以空文本调用一次，重试时调用方据此重置解析状态
+        :return: 累积的完整响应文本
+        """
+        buffer = ""
+        thought_sent = False
+        thought_pos = -1      # "thought" 键在 buffer 中的位置
+        key_scan = 0          # 下次查找 "thought" 键的起点
+        
+        # 括号匹配状态：每个字符只扫描一次，顶层对象闭合时才尝试完整解析
+        scan_pos = 0
+        depth = 0
+        in_string = False
+        first_brace = -1
+        
+        response = client.chat.completions.create(**api_params, stream=True)
+        if on_progress is not None:
+            on_progress(buffer)
+        try:
+            for chunk in response:
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta.content
+                if not delta:
+                    continue
+                buffer += delta
+                
+                # thought 的值只有在新的引号到达时才可能变完整
+                if on_thought is not None and not thought_sent and '"' in delta:
+                    if thought_pos < 0:
+                        thought_pos = buffer.find('"thought"', key_scan)
+                        key_scan = max(0, len(buffer) - len('"thought"') + 1)
+                    if thought_pos >= 0:
+                        match = _THOUGHT_RE.match(buffer, thought_pos)
+                        if match:
+                            thought_sent = True
+                            try:
+                                on_thought(json.loads(f'"{match.group(1)}"'))
+                            except json.JSONDecodeError:
+                                on_thought(match.group(1))
+                
+                # 只有出现右括号时才可能闭合；从上次扫描到的位置继续跟踪括号深度
+                if '}' not in delta:
+                    continue
+                if on_progress is not None:
+                    on_progress(buffer)
+                closed = False
+                for m in _JSON_STRUCT_RE.finditer(buffer, scan_pos):
+                    i = m.start()
+                    if i < scan_pos:
+                        # 被转义的字符
+                        continue
+                    c = m.group()
+                    if in_string:
+                        if c == '\\':
+                            scan_pos = i + 2
+                        elif c == '"':
+                            in_string = False
+                    elif c == '"':
+                        in_string = True
+                    elif c == '{':
+                        if depth == 0:
+                            first_brace = i
+                        depth += 1
+                    elif c == '}' and depth > 0:
+                        depth -= 1
+                        if depth == 0:
+                            scan_pos = i + 1
+                            closed = True
+                            break
+                else:
+                    scan_pos = max(scan_pos, len(buffer))
+                
+                if closed:
+                    try:
+                        _DECODER.raw_decode(buffer, first_brace)
+                        break
+                    except json.JSONDecodeError:
+                        # 闭合的不是完整的 JSON（例如说明文字中的括号），继续等待
+                        pass
+        finally:
+            response.close()
+        
+        return buffer
+    
+    def _send_chat(
+        self,
+        api_params: dict,
+        on_thought: Callable[[str], None] | None = None,
+        on_progress: Callable[[str], None] | None = None
+    ) -> str | None:
+        """
+        发送 chat.completions 请求并返回响应文本；提供 on_thought 或 on_progress 时使用流式请求。
+        
+        每次尝试使用较短的超时，超时或服务端错误时以带抖动的指数退避重试，
+        最多重试 max_retries 次；400 等请求错误直接抛出。
+        """
+        for attempt in range(self.max_retries + 1):
+            client = self.client.with_options(timeout=self._attempt_timeout(attempt), max_retries=0)
+            try:
+                if on_thought is not None or on_progress is not None:
+                    return self._stream_completion(client, api_params, on_thought, on_progress)
+                
+                response = client.chat.completions.create(**api_params)
+                # 确保response不为None
+                if response is None:
+                    raise RuntimeError("API call succeeded but response is None")
+                return response.choices[0].message.content
+            except _RETRYABLE_ERRORS as e:
+                if attempt >= self.max_retries:
+                    raise
+                time.sleep(self._retry_delay(attempt, e))
+    
+    async def _asend_chat(self, api_params: dict) -> str | None:
+        """
+        _send_chat 的异步版本：超时或服务端错误时按相同的退避策略重试。
+        
+        异步客户端在首次异步调用时才创建，与同一事件循环中的其他实例共享连接池。
+        """
+        aclient = _get_async_openai_client(Config.OPENAI_API_KEY, Config.OPENAI_BASE_URL)
+        for attempt in range(self.max_retries + 1):
+            client = aclient.with_options(timeout=self._attempt_timeout(attempt), max_retries=0)
+            try:
+                response = await client.chat.completions.create(**api_params)
+                if response is None:
+                    raise RuntimeError("API call succeeded but response is None")
+                return response.choices[0].message.content
+            except _RETRYABLE_ERRORS as e:
+                if attempt >= self.max_retries:
+                    raise
+                await asyncio.sleep(self._retry_delay(attempt, e))
+    
+    def _call_chat(
+        self,
+        messages: list,
+        *,
+        temperature: float | None = None,
+        on_thought: Callable[[str], None] | None = None,
+        on_progress: Callable[[str], None] | None = None
+    ) -> tuple:
+        """
+        调用 LLM 并返回原始响应文本。
+        
+        统一处理 Ollama / JSON 模式的选择、不支持 JSON 模式时的回退以及流式请求，
+        generate_plan、generate_next_steps、regenerate_command 和 TaskPlanner 共用此逻辑。
+        
+        :param messages: 对话消息
+        :param temperature: 采样温度，None 时使用服务端默认值
+        :param on_thought: 可选回调，提供时以流式方式请求并尽早回调 thought（Ollama 除外）
+        :param on_progress: 可选回调，提供时以流式方式请求，收到含右括号的增量时以累积文本调用（Ollama 除外）
+        :return: (LLM 返回的原始文本, 是否使用了 JSON 模式)
+        """
+        api_params = self._chat_params(messages, temperature)
+        
+        if self.is_ollama:
+            # Ollama 的流式增量格式不稳定，不使用流式请求
+            on_thought = on_progress = None
+        
+        if not self._try_json_mode():
+            return self._send_chat(api_params, on_thought, on_progress), False
+        
+        try:
+            return self._send_chat({**api_params, "response_format": _JSON_MODE}, on_thought, on_progress), True
+        except Exception as e:
+            if not self._is_json_mode_rejection(e):
+                raise
+        
+        # JSON 模式被拒绝，重试不带 JSON 模式
+        raw_content = self._send_chat(api_params, on_thought, on_progress)
+        self._mark_json_mode_supported(False)
+        return raw_content, False
+    
+    async def _acall_chat(self, messages: list, *, temperature: float | None = None) -> tuple:
+        """
+        _call_chat 的异步版本（不支持流式请求）。
+        
+        JSON 模式的选择与回退使用与 _call_chat 相同的判断，只有传输方式不同。
+        
+        :return: (LLM 返回的原始文本, 是否使用了 JSON 模式)
+        """
+        api_params = self._chat_params(messages, temperature)
+        
+        if not self._try_json_mode():
+            return await self._asend_chat(api_params), False
+        
+        try:
+            return await self._asend_chat({**api_params, "response_format": _JSON_MODE}), True
+        except Exception as e:
+            if not self._is_json_mode_rejection(e):
+                raise
+        
+        raw_content = await self._asend_chat(api_params)
+        self._mark_json_mode_supported(False)
+        return raw_content, False
+    
+    def _chat_params(self, messages: list, temperature: float | None) -> dict:
+        """构建 chat.completions 的基础参数"""
+        api_params = {
+            "model": self.model,
+            "messages": messages,
+        }
+        if temperature is not None:
+            api_params["temperature"] = temperature
+        return api_params
+    
+    def _try_json_mode(self) -> bool:
+        """本次请求是否先尝试 JSON 模式：Ollama 和已确认不支持的服务直接普通调用"""
+        if self.is_ollama:
+            # Ollama: 不使用 JSON 模式，依赖 prompt engineering
+            if Config.DEBUG:
+                get_console().print(f"[dim][DEBUG] Using Ollama, relying on prompt for JSON output[/dim]")
+            return False
+        if not self._json_mode_supported():
+            return False
+        if Config.DEBUG:
+            get_console().print(f"[dim][DEBUG] Attempting to enable JSON mode for model: {self.model}[/dim]")
+        return True
+    
+    @staticmethod
+    def _is_json_mode_rejection(e: Exception) -> bool:
+        """JSON 模式请求的异常是否表示服务不支持 JSON 模式（此时应改用普通请求重试）"""
+        error_msg = str(e)
+        if "response_format" not in error_msg and "400" not in error_msg:
+            return False
+        if Config.DEBUG:
+            get_console().print(f"[dim][DEBUG] JSON mode not supported by this API, retrying without it...[/dim]")
+        return True
+    
+    def _run_request(
+        self,
+        cache_key: bytes,
+        build_messages: Callable[[], list],
+        parse: Callable[[str | None, bool], dict],
+        temperature: float | None = None,
+        on_thought: Callable[[str], None] | None = None
+    ) -> dict:
+        """
+        执行一次带缓存的 LLM 请求：命中缓存直接返回，否则请求、解析并写入缓存。
+        
+        :param cache_key: 计划缓存的键
+        :param build_messages: 构建对话消息的函数（命中缓存时不调用）
+        :param parse: 解析并验证响应文本的函数，参数为 (原始文本, 是否使用了 JSON 模式)
+        :param temperature: 采样温度
+        :param on_thought: 可选回调，见 _call_chat
+        """
+        cached = self._cache_get(cache_key)
+        if cached is not None:
+            return cached
+        
+        start_time = time.time()
+        raw_content = None  # 初始化变量以避免未绑定警告
+        try:
+            if Config.DEBUG:
+                get_console().print(f"[dim][DEBUG] Calling LLM API with model: {self.model}[/dim]")
+            
+            raw_content, json_mode = self._call_chat(build_messages(), temperature=temperature, on_thought=on_thought)
+            
+            if Config.DEBUG:
+                get_console().print(f"[dim][DEBUG] LLM API responded in {time.time() - start_time:.2f}s[/dim]")
+            return self._store_result(cache_key, parse(raw_content, json_mode))
+        except Exception as e:
+            self._raise_llm_error(e, raw_content, start_time)
+    
+    async def _arun_request(
+        self,
+        cache_key: bytes,
+        build_messages: Callable[[], list],
+        parse: Callable[[str | None, bool], dict],
+        temperature: float | None = None
+    ) -> dict:
+        """_run_request 的异步版本，只有请求的传输方式不同"""
+        cached = self._cache_get(cache_key)
+        if cached is not None:
+            return cached
+        
+        start_time = time.time()
+        raw_content = None
+        try:
+            raw_content, json_mode = await self._acall_chat(build_messages(), temperature=temperature)
+            return self._store_result(cache_key, parse(raw_content, json_mode))
+        except Exception as e:
+            self._raise_llm_error(e, raw_content, start_time)
+    
+    def _store_result(self, cache_key: bytes, result: dict) -> dict:
+        """写入计划缓存并返回结果"""
+        self._cache_put(cache_key, result)
+        return result
+    
+    def _plan_request(self, user_query: str, context_str: str, error_history: list | None, user_context: str) -> tuple:
+        """generate_plan 与 agenerate_plan 共用的请求描述：(缓存键, 构建消息的函数, 解析函数, 采样温度)"""
+        return (
+            self._cache_key("plan", user_query, context_str, error_history, user_context),
+            lambda: self._build_plan_messages(user_query, context_str, error_history, user_context),
+            self._parse_plan,
+            None
+        )
+    
+    def generate_plan(
+        self,
+        user_query: str,
+        context_str: str,
+        error_history: list | None = None,
+        user_context: str = "",
+        on_thought: Callable[[str], None] | None = None
+    ) -> dict:
+        """
+        根据用户查询和环境上下文生成 Shell 命令计划。
+        
+        :param user_query: 用户的自然语言指令
+        :param context_str: 格式化后的系统环境信息
+        :param error_history: 之前的错误历史，用于重试/自愈逻辑
+        :param user_context: 用户提供的上下文文件内容
+        :param on_thought: 可选回调，流式接收到完整的 thought 字段后立即调用
+        :return: 解析后的 JSON 字典 {"thought": ..., "steps": [{"description":..., "command":...}, ...]}
+        """
+        
+        if Config.DEBUG:
+            get_console().print(f"[dim][DEBUG] Starting plan generation for query: {user_query[:50]}...[/dim]")
+        
+        return self._run_request(
+            *self._plan_request(user_query, context_str, error_history, user_context),
+            on_thought=on_thought
+        )
+    
+    async def agenerate_plan(self, user_query: str, context_str: str, error_history: list | None = None, user_context: str = "") -> dict:
+        """
+        generate_plan 的异步版本。
+        
+        需要多个相互独立的计划时（如自愈修复与预取下一步），可以用
+        asyncio.gather 同时发起请求，让网络往返时间相互重叠。
+        """
+        return await self._arun_request(*self._plan_request(user_query, context_str, error_history, user_context))
+    
+    def _build_batch_plan_messages(self, user_queries: list, context_str: str, error_history: list | None = None, user_context: str = "") -> list:
+        """构建 generate_plans 的对话消息：所有查询放在同一条用户消息中"""
+        numbered = "\n".join(f"{i}. {q}" for i, q in enumerate(user_queries, 1))
+        user_message = f"""User Requests:
+{numbered}
+
+Produce a JSON ARRAY of length {len(user_queries)}, one plan per request in the same order, wrapped in an object:
+{{"plans": [{{"thought": "...", "steps": [{{"description": "...", "command": "..."}}]}}]}}"""
+        if self.is_ollama:
+            user_message += "\n\nDo NOT include any other text, explanations, or markdown. ONLY the JSON object."
+
+        if error_history:
+            error_context = "\n".join([f"Previous failure at step {e.get('step_index', '?')}:\nCommand: {e['command']}\nError: {e['error']}" for e in error_history])
+            user_message += f"\n\nPREVIOUS EXECUTION FAILED. Take these errors into account in every plan:\n{error_context}"
+        
+        return [
+            {"role": "system", "content": _PLAN_SYSTEM_PROMPT_OLLAMA if self.is_ollama else _PLAN_SYSTEM_PROMPT_JSONMODE},
+            self._environment_message(context_str, user_context),
+            {"role": "user", "content": user_message}
+        ]
+    
+    def generate_plans(
+        self,
+        user_queries: list,
+        context_str: str,
+        error_history: list | None = None,
+        user_context: str = ""
+    ) -> list:
+        """
+        在一次 LLM 请求中为多个查询生成计划。
+        
+        共享的系统提示词和环境信息只发送（计费）一次，也只占用一次请求配额；
+        已在计划缓存中的查询不会再发送。
+        
+        :param user_queries: 用户的自然语言指令列表
+        :param context_str: 格式化后的系统环境信息
+        :param error_history: 之前的错误历史，对所有查询生效
+        :param user_context: 用户提供的上下文文件内容
+        :return: 与 user_queries 一一对应的计划列表，格式同 generate_plan
+        """
+        start_time = time.time()
+        
+        plans = [None] * len(user_queries)
+        keys = [self._cache_key("plan", q, context_str, error_history, user_context) for q in user_queries]
+        pending = []
+        for i, key in enumerate(keys):
+            plans[i] = self._cache_get(key)
+            if plans[i] is None:
+                pending.append(i)
+        
+        if not pending:
+            return plans
+        
+        if Config.DEBUG:
+            get_console().print(f"[dim][DEBUG] Generating {len(pending)} plans in one request...[/dim]")
+        
+        messages = self._build_batch_plan_messages([user_queries[i] for i in pending], context_str, error_history, user_context)
+        raw_content = None
+        
+        try:
+            raw_content, json_mode = self._call_chat(messages)
+            if not raw_content:
+                raise ValueError("LLM returned empty response")
+            
+            result = self._extract_json_object(raw_content, json_mode)
+            batch = result.get("plans") if isinstance(result, dict) else None
+            if not isinstance(batch, list):
+                raise ValueError("LLM returned JSON without a 'plans' list")
+            if len(batch) != len(pending):
+                raise ValueError(f"Expected {len(pending)} plans, got {len(batch)}")
+            
+            for i, plan in zip(pending, batch):
+                plans[i] = self._store_result(keys[i], self._validate_plan(plan, raw_content))
+            
+            if Config.DEBUG:
+                get_console().print(f"[dim][DEBUG] Batch plan generation finished in {time.time() - start_time:.2f}s[/dim]")
+            return plans
+            
+        except Exception as e:
+            self._raise_llm_error(e, raw_content, start_time)
+    
+    def _build_next_steps_messages(
+        self,
+        user_goal: str,
+        context_str: str,
+        execution_history: list,
+        max_steps: int = 3,
+        user_context: str = ""
+    ) -> list:
+        """构建 generate_next_steps 的对话消息"""
+        # 构建执行历史摘要
+        history_summary = self._build_history_summary(execution_history)
+        
+        user_message = f"""User Goal: {user_goal}
+
+{history_summary}
+
+Based on the execution history above, generate the next 1-{max_steps} steps to achieve the goal."""
+        if self.is_ollama:
+            user_message += """
+
+IMPORTANT: You MUST respond with ONLY a JSON object in this exact format:
+{
+   "thought": "your reasoning here",
+   "steps": [
+      {"description": "step description", "command": "shell command"}
+   ],
+   "is_complete": false
+}
+
+Do NOT include any other text, explanations, or markdown. ONLY the JSON object."""
+        
+        return [
+            {"role": "system", "content": _NEXT_SYSTEM_PROMPT_OLLAMA if self.is_ollama else _NEXT_SYSTEM_PROMPT_JSONMODE},
+            self._environment_message(context_str, user_context),
+            {"role": "user", "content": user_message}
+        ]
+    
+    def _parse_next_steps(self, raw_content: str | None, json_mode: bool = False) -> dict:
+        """解析并验证 generate_next_steps 的 LLM 响应"""
+        if not raw_content:
+            raise ValueError("LLM returned empty response")
+        
+        result = self._extract_json_object(raw_content, json_mode)
+        
+        # 验证格式
+        if _VALIDATE_NEXT_STEPS is not None:
+            try:
+                _VALIDATE_NEXT_STEPS(result)
+            except fastjsonschema.JsonSchemaValueException as e:
+                raise ValueError(e.message)
+        else:
+            if not isinstance(result, dict):
                 raise ValueError(f"Expected dict, got {type(result)}")
             
             if "steps" not in result:
@@ -625,33 +1198,97 @@ Do NOT include any other text, explanations, or markdown. ONLY the JSON object."
                     raise ValueError(f"Step {i+1} must be a dict, got {type(step)}")
                 if "command" not in step:
                     raise ValueError(f"Step {i+1} missing 'command' field")
-            
-            # 确保 is_complete 字段存在
-            if "is_complete" not in result:
-                result["is_complete"] = False
-            
-            return result
-            
-        except json.JSONDecodeError as e:
-            if Config.DEBUG:
-                console.print(f"[bold red][DEBUG] JSON Parse Error: {str(e)}[/bold red]")
-                console.print(f"[dim][DEBUG] Raw content: {raw_content or 'N/A'}[/dim]")
-            raise ValueError(f"LLM returned invalid JSON: {str(e)}")
-        except Exception as e:
-            elapsed = time.time() - start_time
-            if Config.DEBUG:
-                console.print(f"[bold red][DEBUG] LLM API Error after {elapsed:.2f}s: {type(e).__name__}: {str(e)}[/bold red]")
-                import traceback
-                console.print(f"[dim][DEBUG] Traceback:\n{traceback.format_exc()}[/dim]")
-            raise RuntimeError(f"LLM API Error: {str(e)}")
+                if not isinstance(step["command"], str):
+                    raise ValueError(f"Step {i+1} 'command' must be a string, got {type(step['command'])}")
+        
+        # 确保 is_complete 字段存在
+        if "is_complete" not in result:
+            result["is_complete"] = False
+        
+        return result
+    
+    def generate_next_steps(
+        self,
+        user_goal: str,
+        context_str: str,
+        execution_history: list,
+        max_steps: int = 3,
+        user_context: str = ""
+    ) -> dict:
+        """
+        根据当前状态生成接下来的步骤（渐进式执行）
+        
+        :param user_goal: 用户的总体目标
+        :param context_str: 系统环境信息
+        :param execution_history: 已执行的步骤历史 [{"description": ..., "command": ..., "output": ..., "success": ...}, ...]
+        :param max_steps: 最多生成几个步骤
+        :param user_context: 用户提供的上下文文件内容
+        :return: {"thought": ..., "steps": [...], "is_complete": bool}
+        """
+        
+        if Config.DEBUG:
+            get_console().print(f"[dim][DEBUG] Generating next steps (max: {max_steps})...[/dim]")
+        
+        return self._run_request(*self._next_steps_request(user_goal, context_str, execution_history, max_steps, user_context))
+    
+    async def agenerate_next_steps(
+        self,
+        user_goal: str,
+        context_str: str,
+        execution_history: list,
+        max_steps: int = 3,
+        user_context: str = ""
+    ) -> dict:
+        """generate_next_steps 的异步版本"""
+        return await self._arun_request(*self._next_steps_request(user_goal, context_str, execution_history, max_steps, user_context))
+    
+    def _next_steps_request(self, user_goal: str, context_str: str, execution_history: list, max_steps: int, user_context: str) -> tuple:
+        """generate_next_steps 与 agenerate_next_steps 共用的请求描述：(缓存键, 构建消息的函数, 解析函数, 采样温度)"""
+        return (
+            self._cache_key(f"next:{max_steps}", user_goal, context_str, execution_history, user_context),
+            lambda: self._build_next_steps_messages(user_goal, context_str, execution_history, max_steps, user_context),
+            self._parse_next_steps,
+            # 稍低的温度以获得更确定的输出
+            0.5
+        )
+    
+    def _count_tokens(self, text: str) -> int:
+        """计算文本的 token 数；tiktoken 不可用时按约 4 个字符一个 token 估算"""
+        if self._token_encoder is None:
+            self._token_encoder = False
+            if tiktoken is not None:
+                try:
+                    try:
+                        self._token_encoder = tiktoken.encoding_for_model(self.model)
+                    except KeyError:
+                        # 非 OpenAI 模型名，使用通用编码
+                        self._token_encoder = tiktoken.get_encoding("cl100k_base")
+                except Exception as e:
+                    # 编码文件需要联网下载，离线时退回估算
+                    if Config.DEBUG:
+                        get_console().print(f"[dim][DEBUG] tiktoken unavailable, estimating tokens: {e}[/dim]")
+        
+        if self._token_encoder:
+            return len(self._token_encoder.encode(text))
+        return len(text) // 4 + 1
     
     def _build_history_summary(self, execution_history: list) -> str:
-        """构建执行历史摘要"""
+        """
+        构建执行历史摘要。
+        
+        从最新的步骤向前遍历，在 HISTORY_TOKEN_BUDGET 内保留尽可能多的步骤，
+        超出预算的更早步骤被省略（最新一步总会保留）。
+        """
         if not execution_history:
             return "Execution History: None (this is the first step)"
         
-        summary_parts = ["Execution History:"]
-        for i, step in enumerate(execution_history[-10:], 1):  # 只保留最近10步
+        # 从后向前按下标填充，保留的步骤为 entries[first:]，无需再反转
+        total = len(execution_history)
+        entries = [None] * total
+        first = total
+        budget = self.HISTORY_TOKEN_BUDGET
+        for i in range(total - 1, -1, -1):
+            step = execution_history[i]
             status = "✓" if step.get("success") else "✗"
             desc = step.get("description", "Unknown")
             cmd = step.get("command", "")
@@ -659,14 +1296,19 @@ Do NOT include any other text, explanations, or markdown. ONLY the JSON object."
             
             # 限制输出长度
             if output:
-                output_preview = output[:200] + "..." if len(output) > 200 else output
-                summary_parts.append(f"{i}. {status} {desc}")
-                summary_parts.append(f"   Command: {cmd}")
-                summary_parts.append(f"   Output: {output_preview}")
+                entry = f"{i + 1}. {status} {desc}\n   Command: {cmd}\n   Output: {_trunc(output)}"
             else:
-                summary_parts.append(f"{i}. {status} {desc} (Command: {cmd})")
+                entry = f"{i + 1}. {status} {desc} (Command: {cmd})"
+            
+            budget -= self._count_tokens(entry)
+            if budget < 0 and first < total:
+                break
+            entries[i] = entry
+            first = i
         
-        return "\n".join(summary_parts)
+        if first > 0:
+            return "Execution History:\n(older steps elided)\n" + "\n".join(entries[first:])
+        return "Execution History:\n" + "\n".join(entries)
     
     def regenerate_command(
         self,
@@ -690,7 +1332,7 @@ Do NOT include any other text, explanations, or markdown. ONLY the JSON object."
         """
         
         if Config.DEBUG:
-            console.print(f"[dim][DEBUG] Regenerating command based on user feedback...[/dim]")
+            get_console().print(f"[dim][DEBUG] Regenerating command based on user feedback...[/dim]")
         start_time = time.time()
         
         system_prompt = f"""
@@ -744,50 +1386,21 @@ IMPORTANT: You MUST respond with ONLY a JSON object:
         raw_content = None
         
         try:
-            api_params = {
-                "model": self.model,
-                "messages": [
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": user_message}
-                ],
-                "temperature": 0.3  # 低温度以获得更确定的输出
-            }
-            
-            response = None
-            
-            if self.is_ollama:
-                response = self.client.chat.completions.create(**api_params)
-            else:
-                json_mode_failed = False
-                
-                try:
-                    api_params["response_format"] = {"type": "json_object"}
-                    response = self.client.chat.completions.create(**api_params)
-                except Exception as e:
-                    error_msg = str(e)
-                    if "response_format" in error_msg or "400" in error_msg:
-                        json_mode_failed = True
-                    else:
-                        raise
-                
-                if json_mode_failed:
-                    api_params.pop("response_format", None)
-                    response = self.client.chat.completions.create(**api_params)
+            messages = [
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": user_message}
+            ]
+            # 低温度以获得更确定的输出
+            raw_content, json_mode = self._call_chat(messages, temperature=0.3)
             
             elapsed = time.time() - start_time
             if Config.DEBUG:
-                console.print(f"[dim][DEBUG] Command regenerated in {elapsed:.2f}s[/dim]")
-            
-            if response is None:
-                raise RuntimeError("API call succeeded but response is None")
-            
-            raw_content = response.choices[0].message.content
+                get_console().print(f"[dim][DEBUG] Command regenerated in {elapsed:.2f}s[/dim]")
             
             if not raw_content:
                 raise ValueError("LLM returned empty response")
             
-            cleaned_content = self._clean_json_response(raw_content)
-            result = json.loads(cleaned_content)
+            result = self._extract_json_object(raw_content, json_mode)
             
             # 验证格式
             if not isinstance(result, dict):
@@ -804,11 +1417,11 @@ IMPORTANT: You MUST respond with ONLY a JSON object:
             
         except json.JSONDecodeError as e:
             if Config.DEBUG:
-                console.print(f"[bold red][DEBUG] JSON Parse Error: {str(e)}[/bold red]")
-                console.print(f"[dim][DEBUG] Raw content: {raw_content or 'N/A'}[/dim]")
+                get_console().print(f"[bold red][DEBUG] JSON Parse Error: {str(e)}[/bold red]")
+                get_console().print(f"[dim][DEBUG] Raw content: {raw_content or 'N/A'}[/dim]")
             raise ValueError(f"LLM returned invalid JSON: {str(e)}")
         except Exception as e:
             elapsed = time.time() - start_time
             if Config.DEBUG:
-                console.print(f"[bold red][DEBUG] LLM API Error after {elapsed:.2f}s: {type(e).__name__}: {str(e)}[/bold red]")
+                get_console().print(f"[bold red][DEBUG] LLM API Error after {elapsed:.2f}s: {type(e).__name__}: {str(e)}[/bold red]")
             raise RuntimeError(f"LLM API Error: {str(e)}")
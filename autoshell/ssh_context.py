@@ -1,24 +1,161 @@
 """SSH模式下的远程系统信息收集"""
 
+import functools
+import hashlib
+import json
 import os
+import re
+import socket
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
 from typing import Dict, Optional, Any
 from rich.console import Console
 from .config import Config
+from .ssh_pool import SSH_AVAILABLE, connection_pool, load_paramiko
 
 console = Console()
 
-# 尝试导入paramiko
-try:
-    import paramiko
-    SSH_AVAILABLE = True
-except ImportError:
-    SSH_AVAILABLE = False
-    paramiko = None
+# 远程信息探测命令：全部拼成一个脚本，通过一次 exec_command 执行，
+# 每条命令的输出前加一行分隔标记，避免每条命令单独打开通道、多付一次往返
+_PROBE_MARK = '---MARK:'
+
+_REMOTE_PROBES = (
+    ('os_type', "uname -s"),
+    ('architecture', "uname -m"),
+    ('kernel', "uname -r"),
+    ('os_release', "cat /etc/os-release 2>/dev/null || cat /etc/redhat-release 2>/dev/null || echo 'Unknown'"),
+    ('package_manager', "for p in apt yum dnf pacman zypper apk; do command -v $p >/dev/null 2>&1 && echo $p && break; done"),
+    ('shell', "echo $SHELL"),
+    ('user', "whoami"),
+    ('uid', "id -u"),
+    ('home', "echo $HOME"),
+    ('python_version', "python3 --version 2>&1 || python --version 2>&1 || echo 'Not installed'"),
+    ('has_sudo', "sudo -n true 2>/dev/null && echo 'yes' || echo 'no'"),
+    ('hostname', "hostname"),
+)
+
+
+def _build_probe_script(probes) -> str:
+    """将 (探测名, 命令) 列表拼接为带分隔标记的单个脚本"""
+    return "; ".join(f"echo '{_PROBE_MARK}{name}---'; {cmd}" for name, cmd in probes)
+
+
+# 远程系统信息的磁盘缓存。操作系统、架构、内核等几乎不会变化，缓存一天；
+# 权限相关信息（is_root / has_sudo）可能随时变化，使用较短的有效期单独刷新
+_REMOTE_INFO_CACHE_DIR = os.path.join(
+    os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache'),
+    'autoshell',
+    'remote_info'
+)
+_REMOTE_INFO_TTL = 86400
+_PRIVILEGE_TTL = 300
+
+_PRIVILEGE_PROBES = tuple(p for p in _REMOTE_PROBES if p[0] in ('uid', 'has_sudo'))
+
+# /etc/os-release 的 KEY=VALUE 行，值可以带双引号、单引号或不带引号；
+# 忽略行尾的空白和 CRLF 换行中的 \r
+_OS_RELEASE_RE = re.compile(
+    r'^[ \t]*([A-Za-z0-9_]+)=(?:"([^"\n]*)"|\'([^\'\n]*)\'|(.*?))[ \t\r]*$', re.M
+)
+
+
+# 用户SSH配置文件路径，模块加载时展开一次
+_SSH_CFG_PATH = os.path.expanduser('~/.ssh/config')
+
+
+@functools.lru_cache(maxsize=32)
+def _expand(path: str) -> str:
+    """展开路径中的 ~（结果缓存，同一密钥路径不重复展开）"""
+    return os.path.expanduser(path)
+
+
+def _ssh_config_mtime() -> Optional[float]:
+    """返回SSH配置文件的修改时间，文件不存在时返回 None（一次 stat 同时完成存在性检查）"""
+    try:
+        return os.path.getmtime(_SSH_CFG_PATH)
+    except OSError:
+        return None
+
+
+@functools.lru_cache(maxsize=4)
+def _load_ssh_config(path: str, mtime: float):
+    """
+    解析 SSH 配置文件，按 (路径, 修改时间) 缓存，文件修改后自动重新解析
+
+    :param path: 配置文件路径
+    :param mtime: 配置文件的修改时间，仅作为缓存键
+    :return: paramiko.SSHConfig 对象
+    """
+    ssh_config_obj = load_paramiko().SSHConfig()
+    with open(path) as f:
+        ssh_config_obj.parse(f)
+    return ssh_config_obj
 
 
 class SSHContextManager:
     """SSH模式下的远程系统信息收集"""
     
+    @staticmethod
+    def _resolve_connect_kwargs(ssh_config: Dict[str, Any], timeout: int) -> Dict[str, Any]:
+        """
+        解析SSH配置（合并 ~/.ssh/config 中的主机配置），生成 SSHClient.connect 的参数
+        
+        :param ssh_config: SSH配置字典
+        :param timeout: 连接超时时间（秒）
+        :return: 连接参数字典
+        """
+        host_str = ssh_config.get('host', '')
+        if '@' in host_str:
+            username, hostname = host_str.split('@', 1)
+        else:
+            username = None
+            hostname = host_str
+        
+        port = ssh_config.get('port', 22)
+        password = ssh_config.get('password')
+        key_filename = ssh_config.get('key_filename')
+        
+        # 加载SSH配置文件
+        ssh_config_mtime = _ssh_config_mtime() if hostname else None
+        if ssh_config_mtime is not None:
+            try:
+                ssh_config_obj = _load_ssh_config(_SSH_CFG_PATH, ssh_config_mtime)
+                
+                # 查找主机配置
+                host_config = ssh_config_obj.lookup(hostname)
+                
+                # 从配置文件获取实际的主机名和其他参数
+                hostname = host_config.get('hostname', hostname)
+                if not username and 'user' in host_config:
+                    username = host_config['user']
+                if not key_filename and 'identityfile' in host_config:
+                    key_filename = host_config['identityfile'][0] if isinstance(host_config['identityfile'], list) else host_config['identityfile']
+                if 'port' in host_config:
+                    port = int(host_config['port'])
+            except Exception as e:
+                if Config.DEBUG:
+                    console.print(f"[dim][DEBUG] Failed to parse SSH config: {e}[/dim]")
+        
+        # 连接参数
+        connect_kwargs = {
+            'hostname': hostname,
+            'port': port,
+            'timeout': timeout,
+            # 压缩传输，减少低带宽链路上的数据量
+            'compress': True
+        }
+        
+        if username:
+            connect_kwargs['username'] = username
+        
+        if key_filename:
+            connect_kwargs['key_filename'] = _expand(key_filename)
+        elif password:
+            connect_kwargs['password'] = password
+        
+        return connect_kwargs
+    
     @staticmethod
     def test_connection(ssh_config: Dict[str, Any], timeout: int = 10) -> tuple[bool, str]:
         """
@@ -32,86 +169,46 @@ class SSHContextManager:
             return False, "paramiko not installed. Please install it: pip install paramiko"
         
         try:
-            # 解析SSH配置
-            host_str = ssh_config.get('host', '')
-            if '@' in host_str:
-                username, hostname = host_str.split('@', 1)
-            else:
-                username = None
-                hostname = host_str
+            paramiko = load_paramiko()
+            
+            connect_kwargs = SSHContextManager._resolve_connect_kwargs(ssh_config, timeout)
+            hostname = connect_kwargs['hostname']
+            port = connect_kwargs['port']
+            username = connect_kwargs.get('username')
             
             if not hostname:
                 return False, "Invalid SSH host configuration"
             
-            port = ssh_config.get('port', 22)
-            password = ssh_config.get('password')
-            key_filename = ssh_config.get('key_filename')
-            
-            # 创建SSH客户端
-            client = paramiko.SSHClient()  # type: ignore
-            client.set_missing_host_key_policy(paramiko.AutoAddPolicy())  # type: ignore
+            key_filename = connect_kwargs.get('key_filename')
+            if key_filename and not os.path.exists(key_filename):
+                return False, f"SSH key file not found: {key_filename}"
+            if not (key_filename or username or connect_kwargs.get('password')):
+                return False, "No authentication method provided (username, password, or key)"
             
-            # 加载SSH配置文件
-            ssh_config_obj = paramiko.SSHConfig()  # type: ignore
-            ssh_config_path = os.path.expanduser('~/.ssh/config')
-            if os.path.exists(ssh_config_path):
+            # 先做一次TCP探测，主机不可达或端口未开放时立即返回，不必等SSH握手超时；
+            # 池中已有可用连接时跳过
+            if not connection_pool.is_connected(connect_kwargs):
                 try:
-                    with open(ssh_config_path) as f:
-                        ssh_config_obj.parse(f)
-                    
-                    # 查找主机配置
-                    host_config = ssh_config_obj.lookup(hostname)
-                    
-                    # 从配置文件获取实际的主机名和其他参数
-                    hostname = host_config.get('hostname', hostname)
-                    if not username and 'user' in host_config:
-                        username = host_config['user']
-                    if not key_filename and 'identityfile' in host_config:
-                        key_filename = host_config['identityfile'][0] if isinstance(host_config['identityfile'], list) else host_config['identityfile']
-                    if 'port' in host_config:
-                        port = int(host_config['port'])
-                except Exception as e:
-                    if Config.DEBUG:
-                        console.print(f"[dim][DEBUG] Failed to parse SSH config: {e}[/dim]")
-            
-            # 连接参数
-            connect_kwargs = {
-                'hostname': hostname,
-                'port': port,
-                'timeout': timeout
-            }
-            
-            if username:
-                connect_kwargs['username'] = username
+                    with socket.create_connection((hostname, port), timeout=min(2, timeout)):
+                        pass
+                except OSError as e:
+                    return False, f"Host unreachable: {hostname}:{port} ({e})"
             
-            if key_filename:
-                key_filename = os.path.expanduser(key_filename)
-                if not os.path.exists(key_filename):
-                    return False, f"SSH key file not found: {key_filename}"
-                connect_kwargs['key_filename'] = key_filename
-            elif password:
-                connect_kwargs['password'] = password
-            elif not username:
-                return False, "No authentication method provided (username, password, or key)"
-            
-            # 尝试连接
+            # 尝试连接（复用连接池中已建立的连接）
             try:
-                client.connect(**connect_kwargs)
-                
-                # 执行简单命令测试连接
-                stdin, stdout, stderr = client.exec_command("echo 'connection_test'", timeout=5)
-                output = stdout.read().decode('utf-8').strip()
-                
-                client.close()
+                with connection_pool.borrow(connect_kwargs) as client:
+                    # 执行简单命令测试连接
+                    stdin, stdout, stderr = client.exec_command("echo 'connection_test'", timeout=5)
+                    output = stdout.read().decode('utf-8').strip()
                 
                 if output == 'connection_test':
                     return True, f"Successfully connected to {username}@{hostname}:{port}"
                 else:
                     return False, "Connection established but command execution failed"
                     
-            except paramiko.AuthenticationException:  # type: ignore
+            except paramiko.AuthenticationException:
                 return False, f"Authentication failed for {username}@{hostname}:{port}"
-            except paramiko.SSHException as e:  # type: ignore
+            except paramiko.SSHException as e:
                 return False, f"SSH error: {str(e)}"
             except TimeoutError:
                 return False, f"Connection timeout to {hostname}:{port}"
@@ -133,23 +230,98 @@ class SSHContextManager:
                 console.print(f"[dim][DEBUG] SSH command failed: {command} - {e}[/dim]")
             return ""
     
+    @staticmethod
+    def _split_probe_output(output: str) -> Dict[str, str]:
+        """按分隔标记拆分批量探测脚本的输出，返回 {探测名: 输出}"""
+        results = {}
+        for part in output.split(_PROBE_MARK)[1:]:
+            name, _, value = part.partition('---')
+            results[name] = value.strip()
+        return results
+    
+    @staticmethod
+    def _collect_probes(ssh_client, probes) -> Dict[str, str]:
+        """
+        执行一组探测命令并返回 {探测名: 输出}。
+        
+        先将全部命令合并为一个脚本执行；批量脚本中没有得到结果的探测
+        （例如登录 shell 不兼容整个脚本的语法）再在同一连接上并发逐条执行，
+        总耗时约为最慢的一条而不是各条之和。
+        """
+        output = SSHContextManager._execute_ssh_command(
+            ssh_client, _build_probe_script(probes), timeout=Config.SSH_INFO_TIMEOUT
+        )
+        results = SSHContextManager._split_probe_output(output)
+        
+        missing = [(name, cmd) for name, cmd in probes if name not in results]
+        if missing:
+            if Config.DEBUG:
+                console.print(f"[dim][DEBUG] Batched probe incomplete, running {len(missing)} probes individually[/dim]")
+            # paramiko 的 Transport 支持多线程同时打开通道
+            with ThreadPoolExecutor(max_workers=min(8, len(missing))) as executor:
+                outputs = executor.map(
+                    lambda cmd: SSHContextManager._execute_ssh_command(ssh_client, cmd),
+                    [cmd for _, cmd in missing]
+                )
+                for (name, _), value in zip(missing, outputs):
+                    if value:
+                        results[name] = value
+        
+        return results
+    
+    @staticmethod
+    def _cache_path(username: Optional[str], hostname: str, port: int) -> str:
+        """返回远程信息缓存文件路径，以 user@host:port 的哈希命名"""
+        digest = hashlib.sha1(f"{username or ''}@{hostname}:{port}".encode()).hexdigest()
+        return os.path.join(_REMOTE_INFO_CACHE_DIR, f"{digest}.json")
+    
+    @staticmethod
+    def _load_cached_info(path: str) -> Optional[Dict[str, Any]]:
+        """读取缓存文件，不存在或损坏时返回 None"""
+        try:
+            with open(path, encoding='utf-8') as f:
+                entry = json.load(f)
+            return entry if isinstance(entry, dict) and isinstance(entry.get('info'), dict) else None
+        except (OSError, ValueError):
+            return None
+    
+    @staticmethod
+    def _save_cached_info(path: str, entry: Dict[str, Any]):
+        """写入缓存文件（先写临时文件再替换，避免并发读到半个文件）"""
+        try:
+            cache_dir = os.path.dirname(path)
+            os.makedirs(cache_dir, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=cache_dir, suffix='.tmp')
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(entry, f, ensure_ascii=False)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            if Config.DEBUG:
+                console.print(f"[dim][DEBUG] Failed to write remote info cache: {e}[/dim]")
+    
     @staticmethod
     def _parse_os_release(content: str) -> dict:
-        """解析 /etc/os-release 文件内容"""
-        info = {}
-        for line in content.split('\n'):
-            if '=' in line:
-                key, value = line.split('=', 1)
-                value = value.strip('"').strip("'")
-                info[key] = value
-        return info
+        """
+        解析 /etc/os-release 文件内容
+        
+        >>> SSHContextManager._parse_os_release('NAME="Ubuntu"  \\r\\nID=ubuntu\\r\\nVERSION_ID=\\'22.04\\'\\t\\n')
+        {'NAME': 'Ubuntu', 'ID': 'ubuntu', 'VERSION_ID': '22.04'}
+        """
+        return {
+            m.group(1): m.group(2) or m.group(3) or m.group(4) or ''
+            for m in _OS_RELEASE_RE.finditer(content)
+        }
     
     @staticmethod
-    def get_remote_system_info(ssh_config: Dict[str, Any]) -> Dict[str, Any]:
+    def get_remote_system_info(ssh_config: Dict[str, Any], refresh: bool = False) -> Dict[str, Any]:
         """
         收集远程系统详细信息
         
+        结果按 user@host:port 缓存到磁盘，有效期内直接返回缓存；
+        只有权限信息过期时，仅重新探测 is_root / has_sudo。
+        
         :param ssh_config: SSH配置字典
+        :param refresh: 为 True 时忽略已有缓存，重新收集
         :return: 系统信息字典
         """
         if not SSH_AVAILABLE:
@@ -169,80 +341,64 @@ class SSHContextManager:
         }
         
         try:
-            # 解析SSH配置
-            host_str = ssh_config.get('host', '')
-            if '@' in host_str:
-                username, hostname = host_str.split('@', 1)
-            else:
-                username = None
-                hostname = host_str
-            
-            port = ssh_config.get('port', 22)
-            password = ssh_config.get('password')
-            key_filename = ssh_config.get('key_filename')
-            
-            # 创建SSH客户端
-            client = paramiko.SSHClient()  # type: ignore
-            client.set_missing_host_key_policy(paramiko.AutoAddPolicy())  # type: ignore
-            
-            # 加载SSH配置文件
-            ssh_config_obj = paramiko.SSHConfig()  # type: ignore
-            ssh_config_path = os.path.expanduser('~/.ssh/config')
-            if os.path.exists(ssh_config_path):
-                with open(ssh_config_path) as f:
-                    ssh_config_obj.parse(f)
+            connect_kwargs = SSHContextManager._resolve_connect_kwargs(ssh_config, timeout=10)
+            hostname = connect_kwargs['hostname']
+            port = connect_kwargs['port']
+            username = connect_kwargs.get('username')
+            
+            # 检查磁盘缓存
+            cache_path = SSHContextManager._cache_path(username, hostname, port)
+            now = time.time()
+            cached = None if refresh else SSHContextManager._load_cached_info(cache_path)
+            
+            if cached and now - cached.get('fetched_at', 0) < cached.get('ttl', _REMOTE_INFO_TTL):
+                info = cached['info']
+                if now - cached.get('privilege_fetched_at', 0) < cached.get('privilege_ttl', _PRIVILEGE_TTL):
+                    if Config.DEBUG:
+                        console.print(f"[dim][DEBUG] Using cached remote system info: {cache_path}[/dim]")
+                    return info
                 
-                # 查找主机配置
-                host_config = ssh_config_obj.lookup(hostname)
+                # 只刷新权限信息；连接或探测失败时沿用缓存，其余信息在有效期内仍然可用
+                try:
+                    with connection_pool.borrow(connect_kwargs) as client:
+                        probes = SSHContextManager._collect_probes(client, _PRIVILEGE_PROBES)
+                except Exception as e:
+                    if Config.DEBUG:
+                        console.print(f"[dim][DEBUG] Privilege refresh failed, using cached values: {e}[/dim]")
+                    return info
+                # 探测没有输出（超时、输出被截断等）时保留缓存中的旧值，
+                # 也不更新刷新时间，下次调用时再尝试
+                uid = probes.get('uid')
+                if uid:
+                    info['is_root'] = uid == '0'
+                has_sudo = probes.get('has_sudo')
+                if has_sudo:
+                    info['has_sudo'] = has_sudo == 'yes'
                 
-                # 从配置文件获取实际的主机名和其他参数
-                hostname = host_config.get('hostname', hostname)
-                if not username and 'user' in host_config:
-                    username = host_config['user']
-                if not key_filename and 'identityfile' in host_config:
-                    key_filename = host_config['identityfile'][0] if isinstance(host_config['identityfile'], list) else host_config['identityfile']
-                if 'port' in host_config:
-                    port = int(host_config['port'])
+                if uid and has_sudo:
+                    cached['privilege_fetched_at'] = now
+                if uid or has_sudo:
+                    SSHContextManager._save_cached_info(cache_path, cached)
+                return info
             
-            # 连接参数
-            connect_kwargs = {
-                'hostname': hostname,
-                'port': port,
-                'timeout': 10
-            }
-            
-            if username:
-                connect_kwargs['username'] = username
-            
-            if key_filename:
-                key_filename = os.path.expanduser(key_filename)
-                connect_kwargs['key_filename'] = key_filename
-            elif password:
-                connect_kwargs['password'] = password
-            
-            # 连接
-            client.connect(**connect_kwargs)
+            # 连接（复用连接池中已建立的连接），一次执行全部探测命令
+            with connection_pool.borrow(connect_kwargs) as client:
+                probes = SSHContextManager._collect_probes(client, _REMOTE_PROBES)
             
             # 收集信息
             info = {}
             
             # OS类型
-            os_type = SSHContextManager._execute_ssh_command(client, "uname -s")
-            info["os_type"] = os_type or "Linux"
+            info["os_type"] = probes.get('os_type') or "Linux"
             
             # 架构
-            arch = SSHContextManager._execute_ssh_command(client, "uname -m")
-            info["architecture"] = arch or "unknown"
+            info["architecture"] = probes.get('architecture') or "unknown"
             
             # 内核版本
-            kernel = SSHContextManager._execute_ssh_command(client, "uname -r")
-            info["kernel"] = kernel or "unknown"
+            info["kernel"] = probes.get('kernel') or "unknown"
             
             # 发行版信息
-            os_release = SSHContextManager._execute_ssh_command(
-                client,
-                "cat /etc/os-release 2>/dev/null || cat /etc/redhat-release 2>/dev/null || echo 'Unknown'"
-            )
+            os_release = probes.get('os_release', '')
             
             if os_release and os_release != "Unknown":
                 if "=" in os_release:
@@ -258,58 +414,47 @@ class SSHContextManager:
             else:
                 info['distro_pretty_name'] = 'Unknown Linux'
             
-            # 检测包管理器
-            pkg_managers = ['apt', 'yum', 'dnf', 'pacman', 'zypper', 'apk']
-            for mgr in pkg_managers:
-                result = SSHContextManager._execute_ssh_command(client, f"which {mgr} 2>/dev/null")
-                if result:
-                    info['package_manager'] = mgr
-                    break
-            else:
-                info['package_manager'] = 'unknown'
+            # 包管理器（输出第一个找到的包管理器名称）
+            info['package_manager'] = probes.get('package_manager') or 'unknown'
             
             # Shell类型
-            shell = SSHContextManager._execute_ssh_command(client, "echo $SHELL")
+            shell = probes.get('shell')
             if shell:
                 info['shell'] = os.path.basename(shell)
             else:
                 info['shell'] = 'bash'
             
             # 用户名
-            user = SSHContextManager._execute_ssh_command(client, "whoami")
-            info['user'] = user or 'unknown'
+            info['user'] = probes.get('user') or 'unknown'
             
             # 检查是否为root用户
-            uid = SSHContextManager._execute_ssh_command(client, "id -u")
-            info['is_root'] = uid == '0'
+            info['is_root'] = probes.get('uid') == '0'
             
             # Home目录
-            home = SSHContextManager._execute_ssh_command(client, "echo $HOME")
-            info['home'] = home or '~'
+            info['home'] = probes.get('home') or '~'
             
             # Python版本
-            python_ver = SSHContextManager._execute_ssh_command(
-                client,
-                "python3 --version 2>&1 || python --version 2>&1 || echo 'Not installed'"
-            )
+            python_ver = probes.get('python_version', '')
             if python_ver and "Python" in python_ver:
                 info['python_version'] = python_ver.replace("Python ", "").strip()
             else:
                 info['python_version'] = 'not installed'
             
             # 检查sudo权限
-            has_sudo = SSHContextManager._execute_ssh_command(
-                client,
-                "sudo -n true 2>/dev/null && echo 'yes' || echo 'no'"
-            )
-            info['has_sudo'] = has_sudo == 'yes'
+            info['has_sudo'] = probes.get('has_sudo') == 'yes'
             
             # 主机名
-            hostname_full = SSHContextManager._execute_ssh_command(client, "hostname")
-            info['hostname'] = hostname_full or hostname
-            
-            # 关闭连接
-            client.close()
+            info['hostname'] = probes.get('hostname') or hostname
+            
+            # 探测成功才写入缓存
+            if probes:
+                SSHContextManager._save_cached_info(cache_path, {
+                    "fetched_at": now,
+                    "ttl": _REMOTE_INFO_TTL,
+                    "privilege_fetched_at": now,
+                    "privilege_ttl": _PRIVILEGE_TTL,
+                    "info": info
+                })
             
             return info
             
@@ -319,7 +464,25 @@ class SSHContextManager:
     
     @staticmethod
     def format_remote_context(info: Dict[str, Any]) -> str:
-        """格式化远程系统信息为上下文字符串"""
+        """
+        格式化远程系统信息为上下文字符串
+        
+        同一会话内 info 基本不变，转为有序元组后走缓存；含不可哈希的值时直接格式化。
+        """
+        try:
+            return SSHContextManager._format_frozen(tuple(sorted(info.items())))
+        except TypeError:
+            return SSHContextManager._format_info(info)
+    
+    @staticmethod
+    @functools.lru_cache(maxsize=8)
+    def _format_frozen(items: tuple) -> str:
+        """format_remote_context 的缓存层，参数为 info 的有序 (键, 值) 元组"""
+        return SSHContextManager._format_info(dict(items))
+    
+    @staticmethod
+    def _format_info(info: Dict[str, Any]) -> str:
+        """逐项拼接上下文字符串"""
         lines = []
         
         distro = info.get("distro_pretty_name", "Unknown Linux")
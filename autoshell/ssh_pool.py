@@ -0,0 +1,152 @@
+"""SSH连接池：在进程内复用已认证的SSH连接"""
+
+import atexit
+import functools
+import importlib.util
+import socket
+import threading
+from contextlib import contextmanager
+from typing import Dict, Any, Tuple
+from .config import Config, get_console
+
+# paramiko 会连带导入 cryptography、bcrypt、nacl 等依赖，导入耗时明显。
+# 这里只检查是否已安装，真正的导入推迟到第一次使用SSH时，本地模式不付出这部分启动开销
+SSH_AVAILABLE = importlib.util.find_spec('paramiko') is not None
+
+
+@functools.lru_cache(maxsize=None)
+def load_paramiko():
+    """
+    导入并返回 paramiko 模块，只在首次调用时真正导入
+
+    导入后优先协商 AES-GCM：AEAD 模式一次完成加密和完整性校验，省去单独的 MAC 计算。
+    只调整顺序、不移除算法，不支持 GCM 的服务器仍会回退到 CTR
+    """
+    import paramiko
+
+    fast_ciphers = tuple(
+        c for c in ('aes128-gcm@openssh.com', 'aes256-gcm@openssh.com')
+        if c in paramiko.Transport._cipher_info
+    )
+    paramiko.Transport._preferred_ciphers = fast_ciphers + tuple(
+        c for c in paramiko.Transport._preferred_ciphers if c not in fast_ciphers
+    )
+    return paramiko
+
+
+def tune_transport(transport, keepalive_interval: int):
+    """
+    调整已建立连接的传输层参数
+
+    开启 keepalive，避免空闲连接被 NAT/防火墙静默丢弃；关闭 Nagle 算法（TCP_NODELAY），
+    探测命令、交互输入这类小包不再等待合并，立即发出
+
+    :param transport: paramiko.Transport 对象
+    :param keepalive_interval: keepalive 发送间隔（秒）
+    """
+    transport.set_keepalive(keepalive_interval)
+    try:
+        transport.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    except (AttributeError, OSError):
+        # 通过 ProxyCommand 等非TCP套接字连接时不支持该选项
+        pass
+
+
+class SSHConnectionPool:
+    """
+    按 (用户名, 主机, 端口, 密钥文件) 缓存已认证的 SSHClient。
+
+    同一进程内多次连接同一主机时复用已有连接，省去 TCP 握手、密钥交换和认证；
+    paramiko 的 Transport 支持在一条连接上同时打开多个通道，因此可以被多处共享。
+    """
+
+    def __init__(self, keepalive_interval: int = 30):
+        """
+        :param keepalive_interval: keepalive 发送间隔（秒），避免空闲连接被 NAT/防火墙丢弃
+        """
+        self.keepalive_interval = keepalive_interval
+        self._clients: Dict[Tuple, Any] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(connect_kwargs: Dict[str, Any]) -> Tuple:
+        return (
+            connect_kwargs.get('username'),
+            connect_kwargs.get('hostname'),
+            connect_kwargs.get('port', 22),
+            connect_kwargs.get('key_filename')
+        )
+
+    @staticmethod
+    def _is_alive(client) -> bool:
+        transport = client.get_transport()
+        return transport is not None and transport.is_active()
+
+    def _connect(self, connect_kwargs: Dict[str, Any]):
+        """建立新的SSH连接"""
+        paramiko = load_paramiko()
+        client = paramiko.SSHClient()
+        client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+        client.connect(**connect_kwargs)
+        tune_transport(client.get_transport(), self.keepalive_interval)
+        return client
+
+    @contextmanager
+    def borrow(self, connect_kwargs: Dict[str, Any]):
+        """
+        借出一个可用的 SSHClient，连接不存在或已断开时重新建立。
+
+        连接失败时 paramiko 的异常（认证失败、超时等）原样抛出。
+
+        :param connect_kwargs: 传给 SSHClient.connect 的参数
+        """
+        key = self._key(connect_kwargs)
+
+        with self._lock:
+            client = self._clients.get(key)
+            if client is not None and not self._is_alive(client):
+                client.close()
+                client = None
+
+            if client is None:
+                client = self._connect(connect_kwargs)
+                self._clients[key] = client
+            elif Config.DEBUG:
+                get_console().print(f"[dim][DEBUG] Reusing SSH connection to {key[1]}:{key[2]}[/dim]")
+
+        try:
+            yield client
+        finally:
+            # 使用过程中连接断开的，从池中移除，下次借出时重连
+            if not self._is_alive(client):
+                self.discard(key, client)
+
+    def is_connected(self, connect_kwargs: Dict[str, Any]) -> bool:
+        """池中是否已有到该主机的可用连接"""
+        with self._lock:
+            client = self._clients.get(self._key(connect_kwargs))
+            return client is not None and self._is_alive(client)
+
+    def discard(self, key: Tuple, client):
+        """关闭并移除指定连接"""
+        with self._lock:
+            if self._clients.get(key) is client:
+                del self._clients[key]
+        client.close()
+
+    def close_all(self):
+        """关闭池中的全部连接"""
+        with self._lock:
+            clients = list(self._clients.values())
+            self._clients.clear()
+
+        for client in clients:
+            try:
+                client.close()
+            except Exception:
+                pass
+
+
+# 进程级共享的连接池，退出时关闭全部连接
+connection_pool = SSHConnectionPool()
+atexit.register(connection_pool.close_all)
@@ -2,9 +2,11 @@
 任务规划器模块
 负责将复杂任务分解为多个阶段，并管理阶段依赖关系
 """
-from typing import Dict, List, Optional
 import json
+import re
+from typing import Dict, List, Optional, Tuple
 from rich.console import Console
+from rich.live import Live
 from rich.table import Table
 
 from .adaptive_context import AdaptiveExecutionContext, TaskPhase, StepStatus
@@ -12,6 +14,10 @@ from .llm import LLMClient
 
 console = Console()
 
+_DECODER = json.JSONDecoder()
+# 流式响应中 phases 数组的起始位置
+_PHASES_RE = re.compile(r'"phases"\s*:\s*\[')
+
 
 class TaskPlanner:
     """任务规划器 - 将复杂任务分解为阶段"""
@@ -19,6 +25,10 @@ class TaskPlanner:
     def __init__(self, llm_client: LLMClient):
         self.llm = llm_client
         self.context: Optional[AdaptiveExecutionContext] = None
+        # (上下文, 上下文版本号, 统计结果)
+        self._status_cache: Optional[Tuple[AdaptiveExecutionContext, int, Tuple[bool, bool, float]]] = None
+        # 阶段ID -> ((状态, 步骤数), 进度行文本)，状态未变的阶段直接复用上次的文本
+        self._progress_rows: Dict[int, Tuple[Tuple, str]] = {}
     
     def analyze_and_plan(
         self,
@@ -38,6 +48,7 @@ class TaskPlanner:
         
         # 创建执行上下文
         self.context = AdaptiveExecutionContext()
+        self._progress_rows = {}
         
         # 调用 LLM 生成任务计划
         plan_data = self._generate_task_plan(user_goal, system_context, user_context)
@@ -105,21 +116,43 @@ class TaskPlanner:
 返回 JSON 格式的计划。"""
 
         try:
-            # 调用 LLM
-            response = self.llm.client.chat.completions.create(
-                model=self.llm.model,
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": user_message}
-                ],
-                temperature=0.7
-            )
+            # 流式调用 LLM，阶段对象一闭合就先显示在预览表中；
+            # 重试、JSON 模式回退和 Ollama（不使用流式请求）均由 _call_chat 处理
+            phase_pos = -1
+            preview = self._new_plan_table()
+            
+            with Live(preview, console=console, transient=True, refresh_per_second=8) as live:
+                def on_progress(buffer: str):
+                    nonlocal phase_pos, preview
+                    if not buffer:
+                        # 新的流开始（首次请求或重试），预览表从头开始
+                        phase_pos = -1
+                        preview = self._new_plan_table()
+                        live.update(preview)
+                        return
+                    
+                    phases, phase_pos = self._read_closed_phases(buffer, phase_pos)
+                    for phase_data in phases:
+                        self._add_plan_row(
+                            preview,
+                            phase_data.get("phase_id", "?"),
+                            phase_data.get("name", "未命名阶段"),
+                            phase_data.get("goal", ""),
+                            phase_data.get("dependencies", [])
+                        )
+                
+                content, json_mode = self.llm._call_chat(
+                    [
+                        {"role": "system", "content": system_prompt},
+                        {"role": "user", "content": user_message}
+                    ],
+                    temperature=0.7,
+                    on_progress=on_progress
+                )
             
-            content = response.choices[0].message.content
             if not content:
                 raise ValueError("LLM returned empty response")
-            cleaned_content = self.llm._clean_json_response(content)
-            plan_data = json.loads(cleaned_content)
+            plan_data = self.llm._extract_json_object(content, json_mode)
             
             return plan_data
             
@@ -143,6 +176,35 @@ class TaskPlanner:
                 "potential_challenges": []
             }
     
+    @staticmethod
+    def _read_closed_phases(buffer: str, pos: int) -> Tuple[List[Dict], int]:
+        """
+        从流式缓冲区中读取已经完整闭合的阶段对象
+        
+        :param buffer: 当前累积的响应文本
+        :param pos: 上次读到的位置，-1 表示尚未找到 phases 数组
+        :return: (新闭合的阶段列表, 下次开始读取的位置)
+        """
+        if pos < 0:
+            match = _PHASES_RE.search(buffer)
+            if not match:
+                return [], -1
+            pos = match.end()
+        
+        phases = []
+        while True:
+            while pos < len(buffer) and buffer[pos] in ' \t\r\n,':
+                pos += 1
+            if pos >= len(buffer) or buffer[pos] != '{':
+                return phases, pos
+            try:
+                phase_data, pos = _DECODER.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                # 对象尚未闭合，等待更多内容
+                return phases, pos
+            if isinstance(phase_data, dict):
+                phases.append(phase_data)
+    
     def _create_phases_from_plan(self, plan_data: Dict):
         """从计划数据创建任务阶段"""
         if not self.context:
@@ -164,22 +226,27 @@ class TaskPlanner:
         if not self.context or not self.context.phases:
             return
         
+        table = self._new_plan_table()
+        for phase in self.context.phases:
+            self._add_plan_row(table, phase.phase_id, phase.name, phase.goal, phase.dependencies)
+        
+        console.print(table)
+    
+    @staticmethod
+    def _new_plan_table() -> Table:
+        """创建任务计划表格（不含数据行）"""
         table = Table(title="任务执行计划", show_header=True, header_style="bold magenta")
         table.add_column("阶段", style="cyan", width=6)
         table.add_column("名称", style="green", width=20)
         table.add_column("目标", width=40)
         table.add_column("依赖", style="yellow", width=10)
-        
-        for phase in self.context.phases:
-            deps_str = ", ".join(str(d) for d in phase.dependencies) if phase.dependencies else "-"
-            table.add_row(
-                str(phase.phase_id),
-                phase.name,
-                phase.goal,
-                deps_str
-            )
-        
-        console.print(table)
+        return table
+    
+    @staticmethod
+    def _add_plan_row(table: Table, phase_id, name: str, goal: str, dependencies: List):
+        """向任务计划表格添加一行"""
+        deps_str = ", ".join(str(d) for d in dependencies) if dependencies else "-"
+        table.add_row(str(phase_id), name, goal, deps_str)
     
     def get_next_executable_phase(self) -> Optional[TaskPhase]:
         """获取下一个可执行的阶段"""
@@ -187,34 +254,61 @@ class TaskPlanner:
             return None
         return self.context.get_next_phase()
     
+    def _compute_status(self) -> Tuple[bool, bool, float]:
+        """
+        一次遍历统计全部阶段的状态，结果按上下文版本号缓存
+        
+        :return: (是否全部完成, 是否有失败阶段, 进度 0-1)
+        """
+        context = self.context
+        if not context:
+            return False, False, 0.0
+        
+        cached = self._status_cache
+        if cached and cached[0] is context and cached[1] == context.version:
+            return cached[2]
+        
+        completed = 0
+        any_failed = False
+        for phase in context.phases:
+            if phase.is_complete():
+                completed += 1
+            elif phase.has_failed():
+                any_failed = True
+        
+        total = len(context.phases)
+        status = (completed == total, any_failed, completed / total if total else 0.0)
+        self._status_cache = (context, context.version, status)
+        return status
+    
     def is_plan_complete(self) -> bool:
         """检查计划是否全部完成"""
-        if not self.context:
-            return False
-        return all(phase.is_complete() for phase in self.context.phases)
+        return self._compute_status()[0]
     
     def has_failed_phases(self) -> bool:
         """检查是否有失败的阶段"""
-        if not self.context:
-            return False
-        return any(phase.has_failed() for phase in self.context.phases)
+        return self._compute_status()[1]
     
     def get_progress(self) -> float:
         """获取任务进度（0-1）"""
-        if not self.context or not self.context.phases:
-            return 0.0
-        
-        completed = sum(1 for p in self.context.phases if p.is_complete())
-        return completed / len(self.context.phases)
+        return self._compute_status()[2]
     
     def display_progress(self):
         """显示任务进度"""
         if not self.context:
             return
         
-        console.print("\n[bold]任务进度:[/bold]")
+        lines = ["\n[bold]任务进度:[/bold]"]
         for phase in self.context.phases:
-            console.print(f"  {phase.get_summary()}")
+            key = (phase.status, len(phase.steps))
+            row = self._progress_rows.get(phase.phase_id)
+            if row is None or row[0] != key:
+                row = (key, f"  {phase.get_summary()}")
+                self._progress_rows[phase.phase_id] = row
+            lines.append(row[1])
         
         progress = self.get_progress()
-        console.print(f"\n总体进度: {progress*100:.0f}%")
+        lines.append(f"\n总体进度: {progress*100:.0f}%")
+        
+        # 整块一次输出，避免逐行刷新终端
+        console.print("\n".join(lines))
@@ -5,48 +5,125 @@ Ollama 集成测试脚本
 测试 AutoShell 与 Ollama 的集成是否正常工作。
 """
 
+import io
+import json
 import os
 import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+import httpx
 from rich.console import Console
 from rich.panel import Panel
 
+# orjson 为可选依赖：已安装时用它解析响应，否则使用标准库
+try:
+    import orjson
+    _loads = orjson.loads
+except ImportError:
+    _loads = json.loads
+
 console = Console()
 
-def test_ollama_connection():
+OLLAMA_URL = "http://localhost:11434"
+
+# 复用同一条 keep-alive 连接访问 Ollama，/api/tags 的结果在有效期内直接返回缓存
+_HTTP = httpx.Client(limits=httpx.Limits(max_keepalive_connections=1, max_connections=4), timeout=5)
+_TAGS_TTL = 60
+_TAGS_CACHE = {'ts': 0.0, 'data': None}
+
+
+def fetch_ollama_tags() -> tuple:
+    """
+    获取 Ollama 已安装的模型列表
+    
+    :return: (HTTP状态码, 响应JSON)，状态码非 200 时响应JSON为 None
+    """
+    if _TAGS_CACHE['data'] is not None and time.monotonic() - _TAGS_CACHE['ts'] < _TAGS_TTL:
+        return 200, _TAGS_CACHE['data']
+    
+    response = _HTTP.get(f"{OLLAMA_URL}/api/tags")
+    if response.status_code != 200:
+        return response.status_code, None
+    
+    _TAGS_CACHE['data'] = _loads(response.content)
+    _TAGS_CACHE['ts'] = time.monotonic()
+    return 200, _TAGS_CACHE['data']
+
+def ollama_alive() -> bool:
+    """
+    检查 Ollama 服务是否在运行
+
+    先用 HEAD 请求根路径，不传输响应体；服务不支持 HEAD 时退回 GET
+
+    :return: 服务是否正常响应
+    :raises httpx.HTTPError: 无法连接时
+    """
+    response = _HTTP.head(f"{OLLAMA_URL}/", timeout=2)
+    if response.status_code in (405, 501):
+        response = _HTTP.get(f"{OLLAMA_URL}/", timeout=2)
+    return response.status_code == 200
+
+
+def ollama_has_model(name: str) -> bool:
+    """
+    检查指定模型是否已安装，只查询该模型而不列出全部模型
+
+    :param name: 模型名称，如 qwen2.5:7b
+    :return: 模型是否存在
+    :raises httpx.HTTPError: 无法连接时
+    """
+    response = _HTTP.post(f"{OLLAMA_URL}/api/show", json={"model": name})
+    return response.status_code == 200
+
+def _buffered_console() -> Console:
+    """创建写入内存的 Console，保留与终端一致的颜色和宽度"""
+    return Console(
+        file=io.StringIO(),
+        force_terminal=console.is_terminal,
+        color_system=console.color_system,
+        width=console.width
+    )
+
+
+def test_ollama_connection(out: Console = console):
     """测试 Ollama 连接"""
-    console.print(Panel.fit(
+    out.print(Panel.fit(
         "[bold blue]Ollama 连接测试[/bold blue]",
         border_style="blue"
     ))
     
     try:
-        import requests
-        response = requests.get("http://localhost:11434/api/tags", timeout=5)
-        if response.status_code == 200:
-            console.print("[green]✓[/green] Ollama 服务运行正常")
-            models = response.json().get("models", [])
+        # 服务未启动时直接失败，不再请求模型列表
+        if not ollama_alive():
+            out.print("[red]✗[/red] Ollama 服务响应异常")
+            return False
+        
+        status_code, tags = fetch_ollama_tags()
+        if status_code == 200:
+            out.print("[green]✓[/green] Ollama 服务运行正常")
+            models = tags.get("models", [])
             if models:
-                console.print(f"[green]✓[/green] 已安装 {len(models)} 个模型:")
+                out.print(f"[green]✓[/green] 已安装 {len(models)} 个模型:")
                 for model in models:
-                    console.print(f"  - {model['name']}")
+                    out.print(f"  - {model['name']}")
             else:
-                console.print("[yellow]⚠[/yellow] 未找到已安装的模型")
-                console.print("[dim]提示: 运行 'ollama pull qwen2.5:7b' 下载模型[/dim]")
+                out.print("[yellow]⚠[/yellow] 未找到已安装的模型")
+                out.print("[dim]提示: 运行 'ollama pull qwen2.5:7b' 下载模型[/dim]")
             return True
         else:
-            console.print(f"[red]✗[/red] Ollama 服务响应异常: {response.status_code}")
+            out.print(f"[red]✗[/red] Ollama 服务响应异常: {status_code}")
             return False
     except Exception as e:
-        console.print(f"[red]✗[/red] 无法连接到 Ollama: {str(e)}")
-        console.print("[dim]提示: 确保 Ollama 已安装并运行[/dim]")
-        console.print("[dim]安装: https://ollama.ai[/dim]")
-        console.print("[dim]启动: ollama serve[/dim]")
+        out.print(f"[red]✗[/red] 无法连接到 Ollama: {str(e)}")
+        out.print("[dim]提示: 确保 Ollama 已安装并运行[/dim]")
+        out.print("[dim]安装: https://ollama.ai[/dim]")
+        out.print("[dim]启动: ollama serve[/dim]")
         return False
 
-def test_config():
+def test_config(out: Console = console):
     """测试配置"""
-    console.print("\n")
-    console.print(Panel.fit(
+    out.print("\n")
+    out.print(Panel.fit(
         "[bold blue]配置测试[/bold blue]",
         border_style="blue"
     ))
@@ -61,22 +138,30 @@ def test_config():
         Config.validate()
         
         if Config.is_ollama():
-            console.print("[green]✓[/green] Ollama 配置检测正确")
+            out.print("[green]✓[/green] Ollama 配置检测正确")
         else:
-            console.print("[red]✗[/red] Ollama 配置检测失败")
+            out.print("[red]✗[/red] Ollama 配置检测失败")
             return False
         
-        console.print(f"[green]✓[/green] API Base URL: {Config.OPENAI_BASE_URL}")
-        console.print(f"[green]✓[/green] Model: {Config.LLM_MODEL}")
+        out.print(f"[green]✓[/green] API Base URL: {Config.OPENAI_BASE_URL}")
+        out.print(f"[green]✓[/green] Model: {Config.LLM_MODEL}")
+        
+        # 模型是否已安装只作提示，Ollama 不可达时由连接测试报告
+        try:
+            if not ollama_has_model(Config.LLM_MODEL):
+                out.print(f"[yellow]⚠[/yellow] 模型 {Config.LLM_MODEL} 尚未安装")
+                out.print(f"[dim]提示: 运行 'ollama pull {Config.LLM_MODEL}' 下载模型[/dim]")
+        except httpx.HTTPError:
+            pass
         return True
     except Exception as e:
-        console.print(f"[red]✗[/red] 配置验证失败: {str(e)}")
+        out.print(f"[red]✗[/red] 配置验证失败: {str(e)}")
         return False
 
-def test_llm_client():
+def test_llm_client(out: Console = console):
     """测试 LLM 客户端"""
-    console.print("\n")
-    console.print(Panel.fit(
+    out.print("\n")
+    out.print(Panel.fit(
         "[bold blue]LLM 客户端测试[/bold blue]",
         border_style="blue"
     ))
@@ -88,13 +173,13 @@ def test_llm_client():
         client = LLMClient()
         
         if not client.is_ollama:
-            console.print("[red]✗[/red] LLM 客户端未检测到 Ollama")
+            out.print("[red]✗[/red] LLM 客户端未检测到 Ollama")
             return False
         
-        console.print("[green]✓[/green] LLM 客户端初始化成功")
+        out.print("[green]✓[/green] LLM 客户端初始化成功")
         
         # 测试简单查询
-        console.print("\n[dim]测试查询: '列出当前目录的文件'[/dim]")
+        out.print("\n[dim]测试查询: '列出当前目录的文件'[/dim]")
         context_str = ContextManager.get_context_string()
         
         plan = client.generate_plan(
@@ -103,19 +188,19 @@ def test_llm_client():
         )
         
         if "steps" in plan and len(plan["steps"]) > 0:
-            console.print(f"[green]✓[/green] 成功生成计划，包含 {len(plan['steps'])} 个步骤")
-            console.print(f"[dim]思路: {plan.get('thought', 'N/A')}[/dim]")
+            out.print(f"[green]✓[/green] 成功生成计划，包含 {len(plan['steps'])} 个步骤")
+            out.print(f"[dim]思路: {plan.get('thought', 'N/A')}[/dim]")
             for i, step in enumerate(plan["steps"], 1):
-                console.print(f"[dim]  {i}. {step.get('description', 'N/A')}[/dim]")
+                out.print(f"[dim]  {i}. {step.get('description', 'N/A')}[/dim]")
             return True
         else:
-            console.print("[red]✗[/red] 生成的计划格式不正确")
+            out.print("[red]✗[/red] 生成的计划格式不正确")
             return False
             
     except Exception as e:
-        console.print(f"[red]✗[/red] LLM 客户端测试失败: {str(e)}")
+        out.print(f"[red]✗[/red] LLM 客户端测试失败: {str(e)}")
         import traceback
-        console.print(f"[dim]{traceback.format_exc()}[/dim]")
+        out.print(f"[dim]{traceback.format_exc()}[/dim]")
         return False
 
 def main():
@@ -127,16 +212,29 @@ def main():
         border_style="cyan"
     ))
     
-    results = []
+    # 各测试写入独立的缓冲区，并行运行结束后按固定顺序输出
+    conn_out, cfg_out, llm_out = (_buffered_console() for _ in range(3))
+    
+    def config_then_llm():
+        # LLM 客户端测试依赖配置测试设置的环境变量，两者在同一线程中顺序执行
+        return test_config(cfg_out), test_llm_client(llm_out)
     
-    # 测试 1: Ollama 连接
-    results.append(("Ollama 连接", test_ollama_connection()))
+    # Ollama 连接测试与 配置 → LLM 生成 并行，总耗时取两者中较长的一方
+    with console.status("[bold green]正在运行测试...[/bold green]", spinner="dots"):
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            conn_future = executor.submit(test_ollama_connection, conn_out)
+            cfg_llm_future = executor.submit(config_then_llm)
+            conn_ok = conn_future.result()
+            cfg_ok, llm_ok = cfg_llm_future.result()
     
-    # 测试 2: 配置
-    results.append(("配置验证", test_config()))
+    for out in (conn_out, cfg_out, llm_out):
+        sys.stdout.write(out.file.getvalue())
     
-    # 测试 3: LLM 客户端
-    results.append(("LLM 客户端", test_llm_client()))
+    results = [
+        ("Ollama 连接", conn_ok),
+        ("配置验证", cfg_ok),
+        ("LLM 客户端", llm_ok)
+    ]
     
     # 总结
     console.print("\n")